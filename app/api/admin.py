@@ -0,0 +1,86 @@
+"""
+管理API路由
+提供性能剖析、事件循环延迟监控和请求剖析结果查询，需要管理密钥
+"""
+import asyncio
+import threading
+import time
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from loguru import logger
+
+from ..auth import verify_admin_key
+from ..config import config
+from ..profiling import sampling_profiler, loop_monitor, list_request_profiles, get_request_profile
+
+router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(verify_admin_key)])
+
+
+@router.post("/profile", response_class=PlainTextResponse)
+async def sample_profile(
+    seconds: float = Query(10.0, gt=0, description="采样时长(秒)"),
+    interval_ms: float = Query(5.0, gt=0, description="采样间隔(毫秒)"),
+    loop_only: bool = Query(True, description="只采样事件循环线程")
+):
+    """
+    对进程进行限时采样剖析，返回折叠栈文件(可用flamegraph.pl或speedscope生成火焰图)
+    """
+    if seconds > config.profiling.max_profile_seconds:
+        raise HTTPException(status_code=400, detail=f"采样时长不能超过{config.profiling.max_profile_seconds}秒")
+    if sampling_profiler.running:
+        raise HTTPException(status_code=409, detail="已有采样剖析正在进行")
+    
+    logger.info(f"开始采样剖析: {seconds}s, 间隔{interval_ms}ms")
+    thread_id = threading.get_ident() if loop_only else None
+    try:
+        collapsed = await asyncio.to_thread(sampling_profiler.sample, seconds, interval_ms / 1000, thread_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    filename = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.collapsed"
+    return PlainTextResponse(collapsed, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@router.get("/loop")
+async def loop_stats():
+    """
+    获取事件循环延迟直方图和慢回调调用栈
+    """
+    return loop_monitor.get_stats()
+
+
+@router.post("/loop/start")
+async def start_loop_monitor():
+    """
+    开启事件循环延迟监控
+    """
+    loop_monitor.start()
+    return {"running": loop_monitor.running}
+
+
+@router.post("/loop/stop")
+async def stop_loop_monitor():
+    """
+    关闭事件循环延迟监控
+    """
+    await loop_monitor.stop()
+    return {"running": loop_monitor.running}
+
+
+@router.get("/profiles")
+async def request_profiles():
+    """
+    获取最近的请求剖析列表
+    """
+    return {"profiles": list_request_profiles()}
+
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+async def request_profile(profile_id: str):
+    """
+    获取指定请求的cProfile统计(按累计耗时排序)
+    """
+    profile = get_request_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"剖析结果不存在: {profile_id}")
+    return profile["stats"]
@@ -2,19 +2,25 @@
 聊天API路由
 提供标准的OpenAI兼容的聊天接口
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from loguru import logger
 
 from ..models import ChatCompletionRequest, ChatCompletionResponse
 from ..auth import verify_api_key
+from ..limits import body_schema, parse_body
 from ..services.llm_service import LLMService
+from ..services.fallback import served_model
+from ..services.session_service import SessionService
 
 router = APIRouter(prefix="/v1", tags=["Chat"])
 
 
-@router.post("/chat/completions", response_model=dict)
+@router.post("/chat/completions", response_model=dict, openapi_extra=body_schema(ChatCompletionRequest))
 async def chat_completions(
-    request: ChatCompletionRequest,
+    http_request: Request,
+    http_response: Response,
     api_key: str = Depends(verify_api_key)
 ):
     """
@@ -27,14 +33,59 @@ async def chat_completions(
     - temperature: 温度参数
     - top_p: top_p参数
     - stream: 是否流式输出
+    - session_id: 会话ID，携带时messages只需包含新消息，历史由网关保存
+    
+    model可以是虚拟模型，实际提供服务的模型通过响应头X-Served-Model返回
     """
+    # 认证通过后再增量读取请求体(受大小上限约束)，并直接从JSON字节校验
+    request = await parse_body(http_request, ChatCompletionRequest)
     logger.info(f"收到聊天请求: model={request.model}, messages_count={len(request.messages)}")
     
     try:
-        response = await LLMService.chat_completion(request)
-        logger.info(f"聊天请求成功: model={request.model}")
+        if request.stream:
+            if request.session_id:
+                stream = await SessionService.chat_completion_stream(request, api_key)
+            else:
+                stream = await LLMService.chat_completion_stream(request)
+            logger.info(f"流式聊天请求已建立: model={request.model}, served_model={served_model.get()}")
+            # 客户端提前断开时迭代器可能从未开始，由后台任务保证释放上游连接等资源
+            return StreamingResponse(
+                stream, media_type="text/event-stream", headers={"X-Served-Model": served_model.get()},
+                background=BackgroundTask(stream.aclose)
+            )
+        
+        if request.session_id:
+            response = await SessionService.chat_completion(request, api_key)
+        else:
+            response = await LLMService.chat_completion(request)
+        logger.info(f"聊天请求成功: model={request.model}, served_model={served_model.get()}")
+        http_response.headers["X-Served-Model"] = served_model.get()
         return response
     
     except Exception as e:
         logger.error(f"聊天请求失败: model={request.model}, error={e}")
-        raise 
\ No newline at end of file
+        raise 
+
+
+@router.get("/sessions/{session_id}")
+async def get_session(
+    session_id: str,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    获取会话历史
+    """
+    return {"session_id": session_id, "messages": SessionService.get_history(api_key, session_id)}
+
+
+@router.delete("/sessions/{session_id}")
+async def delete_session(
+    session_id: str,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    删除会话
+    """
+    SessionService.delete(api_key, session_id)
+    logger.info(f"删除会话: {session_id}")
+    return {"session_id": session_id, "deleted": True}
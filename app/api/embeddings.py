@@ -0,0 +1,40 @@
+"""
+嵌入API路由
+提供标准的OpenAI兼容的嵌入接口
+"""
+from fastapi import APIRouter, Depends, Request
+from loguru import logger
+
+from ..models import EmbeddingRequest
+from ..auth import verify_api_key
+from ..limits import body_schema, parse_body
+from ..services.embedding_service import EmbeddingService
+
+router = APIRouter(prefix="/v1", tags=["Embeddings"])
+
+
+@router.post("/embeddings", response_model=dict, openapi_extra=body_schema(EmbeddingRequest))
+async def create_embeddings(
+    http_request: Request,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    嵌入接口（OpenAI兼容）
+    
+    并发的小请求会在短时间窗口内合并为一次上游批量调用
+    
+    支持的参数：
+    - model: 模型名称
+    - input: 输入文本或文本列表
+    - encoding_format: float 或 base64
+    """
+    request = await parse_body(http_request, EmbeddingRequest)
+    count = 1 if isinstance(request.input, str) else len(request.input)
+    logger.info(f"收到嵌入请求: model={request.model}, inputs={count}")
+    
+    try:
+        return await EmbeddingService.create_embeddings(request)
+    
+    except Exception as e:
+        logger.error(f"嵌入请求失败: model={request.model}, error={e}")
+        raise
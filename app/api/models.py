@@ -4,12 +4,16 @@
 """
 import time
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
 from loguru import logger
 
 from ..models import ModelsListResponse, ModelInfo, ModelTestRequest, HealthCheckResponse
 from ..auth import verify_api_key
 from ..config import config
 from ..services.llm_service import LLMService
+from ..services import affinity, fallback
+from ..services.embedding_service import EmbeddingService
+from ..services.warmup import warmup_manager
 
 router = APIRouter(prefix="/v1", tags=["Models"])
 
@@ -37,6 +41,25 @@ async def list_models(api_key: str = Depends(verify_api_key)):
             )
             model_list.append(model_info)
         
+        # 虚拟模型(与真实模型同名的已在上面列出)
+        listed = {model.name for model in models}
+        for alias in config.aliases.values():
+            if alias.name in listed:
+                continue
+            try:
+                _, candidates = fallback.resolve(alias.name)
+            except HTTPException:
+                continue
+            model_list.append(ModelInfo(
+                id=alias.name,
+                object="model",
+                created=int(time.time()),
+                owned_by="llm-gateway",
+                type="alias",
+                max_tokens=min(model.max_tokens for model in candidates),
+                enabled=True
+            ))
+        
         return ModelsListResponse(data=model_list)
     
     except Exception as e:
@@ -91,6 +114,38 @@ async def health_check():
         raise HTTPException(status_code=500, detail=f"健康检查失败: {str(e)}")
 
 
+@router.get("/ready")
+async def readiness_check():
+    """
+    就绪检查接口：启动预热完成或超时前返回503
+    """
+    status_code = 200 if warmup_manager.ready else 503
+    return JSONResponse(
+        status_code=status_code,
+        content={"ready": warmup_manager.ready, "warmup": warmup_manager.status}
+    )
+
+
+@router.get("/warmup")
+async def warmup_report(api_key: str = Depends(verify_api_key)):
+    """
+    获取启动预热报告(每个模型的状态和各步骤耗时)
+    """
+    return warmup_manager.get_report()
+
+
+@router.get("/routing/stats")
+async def routing_stats(api_key: str = Depends(verify_api_key)):
+    """
+    获取路由统计：前缀亲和路由(首选副本命中、溢出次数、前缀缓存命中率)、虚拟模型回退和嵌入微批处理
+    """
+    return {
+        "routers": affinity.get_all_stats(),
+        "aliases": fallback.get_all_stats(),
+        "embedding_batchers": EmbeddingService.get_stats(),
+    }
+
+
 @router.get("/models/{model_name}")
 async def get_model_info(
     model_name: str,
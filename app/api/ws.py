@@ -0,0 +1,32 @@
+"""
+WebSocket API路由
+提供连接级认证、多路复用的聊天接口，适合高频调用的客户端
+"""
+from fastapi import APIRouter, WebSocket
+from loguru import logger
+
+from ..config import config
+from ..services.multiplex import MultiplexConnection
+
+router = APIRouter(prefix="/v1", tags=["WebSocket"])
+
+
+@router.websocket("/ws")
+async def websocket_chat(websocket: WebSocket):
+    """
+    多路复用聊天接口
+    
+    - 认证：握手时携带Authorization: Bearer <key>，或连接后发送 {"type": "auth", "api_key": "..."}
+    - 请求：{"type": "request", "id": "...", "body": {...}}，body与/v1/chat/completions相同
+    - 取消：{"type": "cancel", "id": "..."}
+    
+    消息格式详见 app/services/multiplex.py
+    """
+    await websocket.accept()
+    api_key = await MultiplexConnection.authenticate(websocket, config.websocket)
+    if api_key is None:
+        logger.warning("WebSocket认证失败")
+        return
+    
+    logger.info("WebSocket连接已建立")
+    await MultiplexConnection(websocket, api_key, config.websocket).serve()
@@ -12,6 +12,8 @@ import httpx
 from loguru import logger
 
 from .config import config
+from . import deadline
+from .services.http_client import get_client
 
 
 # Token缓存，TTL为8小时
@@ -35,6 +37,20 @@ async def verify_api_key(credentials: HTTPAuthorizationCredentials = Security(se
     return api_key
 
 
+async def verify_admin_key(credentials: HTTPAuthorizationCredentials = Security(security)) -> str:
+    """验证管理密钥"""
+    api_key = credentials.credentials
+    
+    if not config.is_valid_admin_key(api_key):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无效的管理密钥",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    return api_key
+
+
 class TokenManager:
     """Token管理器，用于Request服务的认证"""
     
@@ -54,40 +70,49 @@ class TokenManager:
             logger.info(f"使用缓存token: {service_config.name}")
             return token_cache[cache_key]
         
-        # 获取新token
+        # 获取新token(受请求截止时间约束，复用共享连接池)
+        deadline.check("获取token")
         try:
-            async with httpx.AsyncClient() as client:
-                auth_data = {
-                    "username": service_config.username,
-                    "password": service_config.password
-                }
-                
-                response = await client.post(
-                    service_config.auth_url,
-                    json=auth_data,
-                    timeout=30.0
-                )
+            client = get_client()
+            auth_data = {
+                "username": service_config.username,
+                "password": service_config.password
+            }
+            
+            response = await client.post(
+                service_config.auth_url,
+                json=auth_data,
+                timeout=deadline.cap(service_config.auth_timeout)
+            )
+            
+            if response.status_code == 200:
+                token_data = response.json()
+                access_token = token_data.get("access_token")
                 
-                if response.status_code == 200:
-                    token_data = response.json()
-                    access_token = token_data.get("access_token")
-                    
-                    if access_token:
-                        # 存储到缓存
-                        token_cache[cache_key] = access_token
-                        logger.info(f"获取新token成功: {service_config.name}")
-                        return access_token
-                    else:
-                        raise HTTPException(
-                            status_code=500,
-                            detail=f"Token响应格式错误: {service_config.name}"
-                        )
+                if access_token:
+                    # 存储到缓存
+                    token_cache[cache_key] = access_token
+                    logger.info(f"获取新token成功: {service_config.name}")
+                    return access_token
                 else:
                     raise HTTPException(
                         status_code=500,
-                        detail=f"获取token失败: {service_config.name}, 状态码: {response.status_code}"
+                        detail=f"Token响应格式错误: {service_config.name}"
                     )
+            else:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"获取token失败: {service_config.name}, 状态码: {response.status_code}"
+                )
         
+        except HTTPException:
+            raise
+        except httpx.TimeoutException as e:
+            logger.error(f"获取token超时: {service_config.name}, {e}")
+            raise HTTPException(
+                status_code=504,
+                detail=f"获取token超时: {service_config.name}"
+            )
         except httpx.RequestError as e:
             logger.error(f"获取token网络错误: {service_config.name}, {e}")
             raise HTTPException(
@@ -0,0 +1,213 @@
+"""
+流量采集模块
+按需记录脱敏后的请求(到达时间、模型、大小、延迟)到有界环形缓冲区，并由后台任务写入滚动JSONL文件
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from loguru import logger
+
+from .config import CaptureConfig
+
+
+class TrafficRecorder:
+    """
+    流量记录器
+    请求路径上只做一次deque追加；JSON解析、脱敏和写文件都在后台批量完成。
+    写入跟不上时环形缓冲区丢弃最旧的记录，条数和请求体总字节数都有上限，保证内存有界。
+    """
+
+    def __init__(self, settings: CaptureConfig):
+        self.settings = settings
+        self.buffer: Deque[Dict[str, Any]] = deque()
+        self.buffer_bytes = 0
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self._file_index = 0
+        self._task: Optional[asyncio.Task] = None
+        self._file = None
+        self._file_path = ""
+        self._file_bytes = 0
+
+    def record(self, entry: Dict[str, Any]):
+        """请求路径上调用，只追加原始数据"""
+        self.recorded += 1
+        self.buffer.append(entry)
+        self.buffer_bytes += _entry_bytes(entry)
+        while self.buffer and (
+            len(self.buffer) > self.settings.ring_size or self.buffer_bytes > self.settings.max_buffer_bytes
+        ):
+            self.buffer_bytes -= _entry_bytes(self.buffer.popleft())
+            self.dropped += 1
+
+    def start(self):
+        """启动后台写入任务"""
+        if self._task is None:
+            os.makedirs(self.settings.directory, exist_ok=True)
+            self._task = asyncio.create_task(self._flush_loop())
+            logger.info(f"流量采集已开启: {self.settings.directory}")
+
+    async def stop(self):
+        """停止后台任务并写出剩余记录"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.settings.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"写入流量采集文件失败: {e}")
+
+    async def flush(self):
+        """取出缓冲区中的记录，在线程中序列化并写入文件"""
+        entries: List[Dict[str, Any]] = []
+        while self.buffer:
+            entry = self.buffer.popleft()
+            self.buffer_bytes -= _entry_bytes(entry)
+            entries.append(entry)
+        if entries:
+            await asyncio.to_thread(self._write, entries)
+            self.written += len(entries)
+
+    def _write(self, entries: List[Dict[str, Any]]):
+        for entry in entries:
+            line = (json.dumps(self._sanitize(entry), ensure_ascii=False) + "\n").encode("utf-8")
+            if self._file is None or self._file_bytes + len(line) > self.settings.max_file_bytes:
+                self._rotate()
+            self._file.write(line)
+            self._file_bytes += len(line)
+        self._file.flush()
+
+    def _rotate(self):
+        """切换到新文件，并删除超出数量上限的旧文件"""
+        if self._file is not None:
+            self._file.close()
+        self._file_index += 1
+        name = f"capture-{time.strftime('%Y%m%d-%H%M%S')}-{self._file_index:04d}.jsonl"
+        self._file_path = os.path.join(self.settings.directory, name)
+        self._file = open(self._file_path, "ab")
+        self._file_bytes = 0
+
+        files = sorted(
+            f for f in os.listdir(self.settings.directory)
+            if f.startswith("capture-") and f.endswith(".jsonl")
+        )
+        for old in files[:-self.settings.max_files]:
+            os.remove(os.path.join(self.settings.directory, old))
+
+    def _sanitize(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """解析请求体并脱敏；不记录任何请求头，也就不会记录API密钥"""
+        raw = entry.pop("raw_body")
+        record = dict(entry)
+        if raw is None:
+            record["body"] = None  # 请求体超过采集上限，回放时跳过
+            return record
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            record["body"] = None
+            return record
+        if isinstance(body, dict):
+            record["model"] = body.get("model")
+            record["stream"] = bool(body.get("stream"))
+            body.pop("user", None)
+            if self.settings.redact_content:
+                _redact(body)
+        record["body"] = body if self.settings.include_bodies else None
+        return record
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "recorded": self.recorded,
+            "written": self.written,
+            "buffered": len(self.buffer),
+            "buffered_bytes": self.buffer_bytes,
+            "dropped": self.dropped,
+            "current_file": self._file_path,
+        }
+
+
+def _entry_bytes(entry: Dict[str, Any]) -> int:
+    """记录在缓冲区中的大致占用，主要是原始请求体"""
+    return len(entry.get("raw_body") or b"") + 256
+
+
+def _redact(body: Dict[str, Any]):
+    """将消息/输入内容替换为等长占位符，保留负载形状和大小"""
+    for msg in body.get("messages") or []:
+        if isinstance(msg, dict) and isinstance(msg.get("content"), str):
+            msg["content"] = "x" * len(msg["content"])
+    inputs = body.get("input")
+    if isinstance(inputs, str):
+        body["input"] = "x" * len(inputs)
+    elif isinstance(inputs, list):
+        body["input"] = ["x" * len(i) if isinstance(i, str) else i for i in inputs]
+
+
+class CaptureMiddleware:
+    """ASGI中间件：记录匹配路径的请求体、响应大小和延迟"""
+
+    def __init__(self, app, recorder: TrafficRecorder):
+        self.app = app
+        self.recorder = recorder
+        self.paths = set(recorder.settings.paths)
+        self.max_body_bytes = recorder.settings.max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        arrival = time.time()
+        started = time.perf_counter()
+        chunks: List[bytes] = []
+        state = {"request_bytes": 0, "response_bytes": 0, "status": 0, "ttfb": None}
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                state["request_bytes"] += len(body)
+                if state["request_bytes"] <= self.max_body_bytes:
+                    chunks.append(body)
+            return message
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                if state["ttfb"] is None:
+                    state["ttfb"] = time.perf_counter() - started
+                state["response_bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            latency = time.perf_counter() - started
+            self.recorder.record({
+                "ts": arrival,
+                "path": scope["path"],
+                "status": state["status"],
+                "request_bytes": state["request_bytes"],
+                "response_bytes": state["response_bytes"],
+                "ttfb_ms": round((state["ttfb"] or latency) * 1000, 3),
+                "latency_ms": round(latency * 1000, 3),
+                "raw_body": b"".join(chunks) if state["request_bytes"] <= self.max_body_bytes else None,
+            })
@@ -0,0 +1,353 @@
+"""
+压缩模块
+负责响应压缩协商(gzip/br/zstd)、SSE流式刷新以及压缩请求体的解压
+"""
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from loguru import logger
+
+from .responses import send_error
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - 可选依赖
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 可选依赖
+    zstandard = None
+
+
+def available_encodings() -> List[str]:
+    """当前环境可用的压缩算法"""
+    encodings = ["gzip"]
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    return encodings
+
+
+def upstream_accept_encoding() -> str:
+    """请求上游时可声明的Accept-Encoding(仅包含httpx能解码的算法)"""
+    encodings = ["gzip", "deflate"]
+    if brotli is not None:
+        encodings.append("br")
+    return ", ".join(encodings)
+
+
+class Compressor:
+    """流式压缩器，统一gzip/br/zstd的接口"""
+
+    def __init__(self, encoding: str, level: Optional[int] = None):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._obj = zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=4 if level is None else level)
+        elif encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+        else:
+            raise ValueError(f"不支持的压缩算法: {encoding}")
+
+    def compress(self, data: bytes) -> bytes:
+        """压缩数据(可能被压缩器内部缓冲)"""
+        if self.encoding == "br":
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        """同步刷新，保证已写入的数据能被客户端立即解出"""
+        if self.encoding == "gzip":
+            return self._obj.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "br":
+            return self._obj.flush()
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        """结束压缩流"""
+        if self.encoding == "gzip":
+            return self._obj.flush(zlib.Z_FINISH)
+        if self.encoding == "br":
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+# 解压时单次输出的块大小，压缩炸弹在展开超过该大小前就会被发现
+_OUTPUT_CHUNK_SIZE = 64 * 1024
+
+
+class Decompressor:
+    """流式解压器，带解压后大小上限，防止压缩炸弹"""
+
+    def __init__(self, encoding: str, max_size: int):
+        self.encoding = encoding
+        self.max_size = max_size
+        self.total = 0
+        if encoding == "gzip":
+            self._obj = zlib.decompressobj(47)  # 自动识别gzip/zlib头
+        elif encoding == "deflate":
+            self._obj = zlib.decompressobj()
+        elif encoding == "br" and brotli is not None:
+            self._obj = brotli.Decompressor()
+        elif encoding == "zstd" and zstandard is not None:
+            # decompressobj会一次性展开整个数据块，改用stream_writer按块写入有界缓冲
+            self._sink = _BoundedSink()
+            self._obj = zstandard.ZstdDecompressor().stream_writer(
+                self._sink, write_size=_OUTPUT_CHUNK_SIZE, write_return_read=True
+            )
+        else:
+            raise ValueError(f"不支持的请求压缩算法: {encoding}")
+
+    def decompress(self, data: bytes) -> bytes:
+        """解压数据块，超过上限时抛出OverflowError"""
+        if self.encoding in ("gzip", "deflate"):
+            # 限制单次输出长度，避免一个小数据块解压出巨大内容
+            out = self._obj.decompress(data, self.max_size - self.total + 1)
+            if self._obj.unconsumed_tail:
+                raise OverflowError("请求体解压后超过大小限制")
+        elif self.encoding == "br":
+            out = self._decompress_brotli(data)
+        else:
+            self._sink.limit = self.max_size - self.total
+            try:
+                self._obj.write(data)
+                out = bytes(self._sink.buffer)
+            finally:
+                self._sink.buffer.clear()
+        self.total += len(out)
+        if self.total > self.max_size:
+            raise OverflowError("请求体解压后超过大小限制")
+        return out
+
+    def _decompress_brotli(self, data: bytes) -> bytes:
+        """限制单次输出缓冲，分多次取出解压结果，每次都检查上限"""
+        chunk = self._obj.process(data, output_buffer_limit=_OUTPUT_CHUNK_SIZE)
+        out = bytearray(chunk)
+        # 输出缓冲写满说明可能还有未取出的数据
+        while not self._obj.is_finished() and (
+            len(chunk) >= _OUTPUT_CHUNK_SIZE or not self._obj.can_accept_more_data()
+        ):
+            if self.total + len(out) > self.max_size:
+                raise OverflowError("请求体解压后超过大小限制")
+            chunk = self._obj.process(b"", output_buffer_limit=_OUTPUT_CHUNK_SIZE)
+            out += chunk
+        return bytes(out)
+
+
+class _BoundedSink:
+    """zstd stream_writer的输出目标，累计超过limit时立即中止解压"""
+
+    def __init__(self):
+        self.limit = 0
+        self.buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        if len(self.buffer) > self.limit:
+            raise OverflowError("请求体解压后超过大小限制")
+        return len(data)
+
+
+def negotiate_encoding(accept_encoding: str, preferred: List[str]) -> Optional[str]:
+    """根据Accept-Encoding与服务端优先级选择压缩算法"""
+    if not accept_encoding:
+        return None
+
+    qvalues: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qvalues[token] = q
+
+    best: Optional[Tuple[float, int, str]] = None
+    for index, encoding in enumerate(preferred):
+        q = qvalues.get(encoding, qvalues.get("*", 0.0))
+        if q <= 0:
+            continue
+        # q值优先，其次服务端顺序
+        candidate = (q, -index, encoding)
+        if best is None or candidate > best:
+            best = candidate
+    return best[2] if best else None
+
+
+class CompressionMiddleware:
+    """
+    ASGI压缩中间件
+    - 非流式响应：超过阈值时整体压缩
+    - 流式响应(SSE等)：每个数据块压缩后立即同步刷新，保证事件实时到达
+    - 请求体：支持Content-Encoding为gzip/deflate/br/zstd的请求
+    """
+
+    def __init__(self, app, settings):
+        self.app = app
+        self.settings = settings
+        enabled = set(available_encodings())
+        self.preferred = [e for e in settings.algorithms if e in enabled]
+        missing = [e for e in settings.algorithms if e not in enabled]
+        if missing:
+            logger.warning(f"压缩算法依赖未安装，已忽略: {missing}")
+
+    def _level(self, encoding: str) -> int:
+        if encoding == "gzip":
+            return self.settings.gzip_level
+        if encoding == "br":
+            return self.settings.brotli_quality
+        return self.settings.zstd_level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.settings.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.lower(): v for k, v in scope["headers"]}
+
+        # 解压请求体
+        content_encoding = headers.get(b"content-encoding", b"").decode("latin-1").strip().lower()
+        if content_encoding and content_encoding != "identity" and self.settings.decompress_requests:
+            try:
+                decompressor = Decompressor(content_encoding, self.settings.max_decompressed_size)
+            except ValueError as e:
+                await send_error(send, 415, str(e))
+                return
+            scope = dict(scope)
+            scope["headers"] = [
+                (k, v) for k, v in scope["headers"]
+                if k.lower() not in (b"content-encoding", b"content-length")
+            ]
+            receive = _decompressing_receive(receive, decompressor)
+
+        encoding = negotiate_encoding(
+            headers.get(b"accept-encoding", b"").decode("latin-1"), self.preferred
+        )
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressingResponder(send, encoding, self._level(encoding), self.settings.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+def _decompressing_receive(receive, decompressor: Decompressor):
+    """包装receive，逐块解压请求体"""
+
+    async def wrapped():
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+            try:
+                body = decompressor.decompress(message.get("body", b""))
+            except OverflowError:
+                raise HTTPException(status_code=413, detail="请求体解压后超过大小限制")
+            except Exception:
+                raise HTTPException(status_code=400, detail="请求体解压失败")
+            more_body = message.get("more_body", False)
+            # 跳过解压后为空的中间块，避免向应用传递空消息
+            if body or not more_body:
+                return {"type": "http.request", "body": body, "more_body": more_body}
+
+    return wrapped
+
+
+class _CompressingResponder:
+    """拦截响应消息并按需压缩"""
+
+    def __init__(self, send, encoding: str, level: int, minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.level = level
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.compressor: Optional[Compressor] = None
+        self.passthrough = False
+        self.streaming = False
+
+    async def send(self, message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            self.start_message = message
+            headers = {k.lower(): v for k, v in message.get("headers", [])}
+            if b"content-encoding" in headers:
+                self.passthrough = True
+            self.streaming = headers.get(b"content-type", b"").startswith(b"text/event-stream")
+            return
+
+        if self.compressor is not None:
+            # 已开始压缩的流式响应
+            await self._send_stream(message)
+            return
+
+        if message_type != "http.response.body" or self.start_message is None:
+            await self._send(message)
+            return
+
+        if self.passthrough:
+            await self._send(self.start_message)
+            self.start_message = None
+            await self._send(message)
+            return
+
+        # 首个body消息：决定是否压缩
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not more_body and not self.streaming and len(body) < self.minimum_size:
+            self.passthrough = True
+            await self._send(self.start_message)
+            self.start_message = None
+            await self._send(message)
+            return
+
+        self.compressor = Compressor(self.encoding, self.level)
+        start = self.start_message
+        self.start_message = None
+        headers = [
+            (k, v) for k, v in start.get("headers", [])
+            if k.lower() not in (b"content-length", b"content-encoding")
+        ]
+        headers.append((b"content-encoding", self.encoding.encode()))
+        headers.append((b"vary", b"Accept-Encoding"))
+
+        if not more_body:
+            data = self.compressor.compress(body) + self.compressor.finish()
+            headers.append((b"content-length", str(len(data)).encode()))
+            await self._send({**start, "headers": headers})
+            await self._send({"type": "http.response.body", "body": data})
+            return
+
+        await self._send({**start, "headers": headers})
+        await self._send({"type": "http.response.body", "body": self._chunk(body), "more_body": True})
+
+    def _chunk(self, body: bytes) -> bytes:
+        return self.compressor.compress(body) + self.compressor.flush()
+
+    async def _send_stream(self, message):
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+        body = message.get("body", b"")
+        if message.get("more_body", False):
+            await self._send({"type": "http.response.body", "body": self._chunk(body), "more_body": True})
+        else:
+            data = self.compressor.compress(body) + self.compressor.finish()
+            await self._send({"type": "http.response.body", "body": data})
+
+
+def compress_body(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """一次性压缩数据，用于上游请求体压缩和基准测试"""
+    compressor = Compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
@@ -4,8 +4,8 @@
 """
 import yaml
 import os
-from typing import Dict, List, Any
-from pydantic import BaseModel
+from typing import Dict, List, Any, Optional, Union
+from pydantic import BaseModel, field_validator
 from loguru import logger
 
 
@@ -24,6 +24,59 @@ class ModelConfig(BaseModel):
     password: str = ""
     token: str = ""  # 直接配置的token
     token_cache_hours: int = 8
+    auth_timeout: float = 30.0  # 获取token的超时(秒)
+    # 上游分阶段超时(秒)
+    connect_timeout: float = 10.0  # 建立连接
+    first_byte_timeout: float = 120.0  # 发出请求到收到响应头
+    idle_timeout: float = 60.0  # 读取响应时两个数据块之间的最大间隔
+    total_timeout: float = 600.0  # 整个上游调用
+    # 自适应超时：根据观测延迟分位数收紧流式首字节和分块间隔超时(不超过上面的配置值)，非流式调用和总超时不受影响
+    adaptive_timeout: bool = False
+    adaptive_percentile: float = 0.99
+    adaptive_multiplier: float = 3.0
+    adaptive_min_timeout: float = 5.0
+    adaptive_min_samples: int = 20
+    adaptive_window: int = 200
+    # 上游压缩配置
+    upstream_compression: bool = True  # 向上游声明Accept-Encoding
+    request_compression: str = ""  # 上游请求体压缩算法(gzip/zstd)，需上游支持
+    request_compression_min_size: int = 4096
+    # 多副本路由配置(自部署模型)
+    replicas: List[str] = []  # 副本base_url列表，为空时使用base_url
+    routing: str = ""  # 路由模式: prefix_affinity(按消息前缀一致性哈希)
+    affinity_prefix_turns: int = 2  # 参与前缀哈希的非系统消息条数
+    affinity_load_factor: float = 1.25  # 有界负载系数，单副本在途请求上限为平均值的该倍数
+    affinity_virtual_nodes: int = 100
+    affinity_tracked_prefixes: int = 10000  # 用于统计命中率的前缀记录数
+    task: str = "chat"  # 模型用途: chat(聊天) / embedding(嵌入)，预热探测据此选择上游接口
+    # 嵌入模型微批处理配置
+    embedding_batch_size: int = 64  # 单次上游批量调用的最大输入条数
+    embedding_max_wait_ms: float = 5.0  # 凑批的最长等待时间(毫秒)
+    embedding_cache_size: int = 0  # 按输入哈希缓存的向量条数，0为不缓存
+    # 请求/响应大小上限(字节)，0为使用server中的全局上限
+    max_request_bytes: int = 0  # 发往上游的请求体(会话模式下包含拼接的历史)
+    max_response_bytes: int = 0  # 非流式上游响应体
+
+
+class AliasTarget(BaseModel):
+    """虚拟模型的目标模型"""
+    model: str
+    weight: float = 1.0  # weighted策略下的选择权重
+
+
+class AliasConfig(BaseModel):
+    """虚拟模型配置模型"""
+    name: str
+    strategy: str = "fallback"  # fallback: 按顺序尝试; weighted: 按权重选择首选模型，失败时再尝试其余模型
+    models: List[AliasTarget]
+    retry_on: List[int] = [429, 500, 502, 503, 504]  # 触发回退的上游状态码(网络错误为500，超时为504)
+    max_attempts: int = 0  # 单次请求最多尝试的模型数，0为不限制
+    
+    @field_validator("models", mode="before")
+    @classmethod
+    def _parse_targets(cls, value: List[Union[str, Dict[str, Any]]]):
+        # 支持直接写模型名: models: ["qwen-max", "gpt-4"]
+        return [{"model": item} if isinstance(item, str) else item for item in value]
 
 
 class ServerConfig(BaseModel):
@@ -31,11 +84,82 @@ class ServerConfig(BaseModel):
     host: str = "0.0.0.0"
     port: int = 8000
     debug: bool = False
+    default_request_timeout: float = 0  # 未携带截止时间请求头时的默认超时(秒)，0为不限制
+    max_request_bytes: int = 16 * 1024 * 1024  # 客户端请求体上限，超出返回413
+    max_response_bytes: int = 64 * 1024 * 1024  # 非流式上游响应体上限，超出返回502
+    max_error_body_bytes: int = 2048  # 上游错误响应写入日志和错误信息的最大字节数
+
+
+class CompressionConfig(BaseModel):
+    """压缩配置模型"""
+    enabled: bool = True
+    minimum_size: int = 1024  # 小于该字节数的非流式响应不压缩
+    algorithms: List[str] = ["zstd", "br", "gzip"]  # 服务端优先级
+    gzip_level: int = 6
+    brotli_quality: int = 4
+    zstd_level: int = 3
+    decompress_requests: bool = True
+    max_decompressed_size: int = 32 * 1024 * 1024
+
+
+class CaptureConfig(BaseModel):
+    """流量采集配置模型"""
+    enabled: bool = False
+    directory: str = "captures"
+    paths: List[str] = ["/v1/chat/completions"]
+    ring_size: int = 10000  # 内存环形缓冲区容量，写入跟不上时丢弃最旧记录
+    max_buffer_bytes: int = 64 * 1024 * 1024  # 环形缓冲区中请求体总字节数上限，超出时丢弃最旧记录
+    flush_interval: float = 1.0  # 后台写文件间隔(秒)
+    max_file_bytes: int = 64 * 1024 * 1024  # 单个JSONL文件大小上限，超出后滚动
+    max_files: int = 10
+    max_body_bytes: int = 1024 * 1024  # 超过该大小的请求体不记录内容
+    include_bodies: bool = True  # 回放需要请求体
+    redact_content: bool = True  # 将消息内容替换为等长占位符(保留负载形状和大小，回放不受影响)
+
+
+class ProfilingConfig(BaseModel):
+    """性能剖析配置模型"""
+    loop_monitor: bool = False  # 启动时开启事件循环延迟监控
+    loop_monitor_interval: float = 0.1  # 延迟采样间隔(秒)
+    slow_callback_threshold: float = 0.1  # 循环阻塞超过该时长(秒)时记录调用栈
+    slow_callback_history: int = 50
+    max_profile_seconds: float = 60.0  # 采样剖析的最长时长
+    request_profile_sample_rate: float = 0.0  # 携带X-Profile头的请求中被剖析的比例，0为关闭
+    request_profile_history: int = 20
+    request_profile_top: int = 40  # pstats输出的函数条数
+
+
+class SessionConfig(BaseModel):
+    """服务端会话配置模型"""
+    max_sessions: int = 10000
+    max_bytes: int = 256 * 1024 * 1024  # 内存中所有会话历史的总大小上限
+    max_messages: int = 1000  # 单个会话保留的消息条数，超出时丢弃最早的非系统消息
+    ttl: float = 3600.0  # 会话空闲超过该时长(秒)后过期
+    spill_dir: str = ""  # 淘汰的会话压缩写入该目录，为空时直接丢弃
+
+
+class WarmupConfig(BaseModel):
+    """启动预热配置模型"""
+    enabled: bool = True
+    timeout: float = 30.0  # 预热总时长上限(秒)，超时后就绪接口直接返回就绪
+    connections: int = 2  # 每个上游地址预先建立的连接数
+    probe: bool = False  # 是否发送一次最小化的探测请求(会产生少量token消耗)
+    probe_message: str = "ping"
+
+
+class WebSocketConfig(BaseModel):
+    """WebSocket多路复用配置模型"""
+    enabled: bool = True
+    max_inflight: int = 64  # 单连接最大并发请求数，超出时该请求返回429
+    send_queue_size: int = 256  # 单连接待发送消息队列长度，队列满时暂停读取上游和客户端消息(背压)
+    auth_timeout: float = 10.0  # 未携带Authorization头时，等待首条auth消息的时长(秒)
+    max_message_bytes: int = 4 * 1024 * 1024  # 单条客户端消息的大小上限
 
 
 class AuthConfig(BaseModel):
     """认证配置模型"""
     api_keys: List[str] = []
+    admin_keys: List[str] = []  # 管理接口(/admin)使用的密钥
 
 
 class Config:
@@ -44,8 +168,15 @@ class Config:
     def __init__(self, config_path: str = "config/models.yaml"):
         self.config_path = config_path
         self.models: Dict[str, List[ModelConfig]] = {}
+        self.aliases: Dict[str, AliasConfig] = {}
         self.server: ServerConfig = ServerConfig()
         self.auth: AuthConfig = AuthConfig()
+        self.compression: CompressionConfig = CompressionConfig()
+        self.capture: CaptureConfig = CaptureConfig()
+        self.profiling: ProfilingConfig = ProfilingConfig()
+        self.sessions: SessionConfig = SessionConfig()
+        self.warmup: WarmupConfig = WarmupConfig()
+        self.websocket: WebSocketConfig = WebSocketConfig()
         self.load_config()
     
     def load_config(self):
@@ -65,6 +196,12 @@ class Config:
                         ModelConfig(**model) for model in models
                     ]
             
+            # 加载虚拟模型配置(可与真实模型同名，同名时优先按虚拟模型解析)
+            if 'aliases' in config_data:
+                self.aliases = {
+                    alias['name']: AliasConfig(**alias) for alias in config_data['aliases'] or []
+                }
+            
             # 加载服务器配置
             if 'server' in config_data:
                 self.server = ServerConfig(**config_data['server'])
@@ -73,6 +210,30 @@ class Config:
             if 'auth' in config_data:
                 self.auth = AuthConfig(**config_data['auth'])
             
+            # 加载压缩配置
+            if 'compression' in config_data:
+                self.compression = CompressionConfig(**config_data['compression'])
+            
+            # 加载流量采集配置
+            if 'capture' in config_data:
+                self.capture = CaptureConfig(**config_data['capture'])
+            
+            # 加载性能剖析配置
+            if 'profiling' in config_data:
+                self.profiling = ProfilingConfig(**config_data['profiling'])
+            
+            # 加载会话配置
+            if 'sessions' in config_data:
+                self.sessions = SessionConfig(**config_data['sessions'])
+            
+            # 加载启动预热配置
+            if 'warmup' in config_data:
+                self.warmup = WarmupConfig(**config_data['warmup'])
+            
+            # 加载WebSocket配置
+            if 'websocket' in config_data:
+                self.websocket = WebSocketConfig(**config_data['websocket'])
+            
             logger.info(f"配置文件加载成功: {self.config_path}")
             
         except Exception as e:
@@ -94,9 +255,17 @@ class Config:
                     return model
         raise ValueError(f"模型 {name} 未找到或未启用")
     
+    def get_alias(self, name: str) -> Optional[AliasConfig]:
+        """根据名称获取虚拟模型配置，不存在时返回None"""
+        return self.aliases.get(name)
+    
     def is_valid_api_key(self, api_key: str) -> bool:
         """验证API密钥"""
         return api_key in self.auth.api_keys
+    
+    def is_valid_admin_key(self, api_key: str) -> bool:
+        """验证管理密钥"""
+        return api_key in self.auth.admin_keys
 
 
 # 全局配置实例
@@ -0,0 +1,117 @@
+"""
+请求截止时间模块
+解析客户端传入的截止时间，并在token获取、排队和上游调用等各阶段传递
+"""
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Optional, TypeVar
+
+from fastapi import HTTPException
+
+from .responses import send_error
+
+T = TypeVar("T")
+
+# 相对超时(秒)，例如 X-Request-Timeout: 12.5
+TIMEOUT_HEADER = b"x-request-timeout"
+# 绝对截止时间(Unix时间戳，秒)，例如 X-Request-Deadline: 1760000000.5
+DEADLINE_HEADER = b"x-request-deadline"
+
+# 当前请求的截止时间(time.monotonic()基准)，None表示不限制
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def set_deadline(timeout: Optional[float]):
+    """设置当前上下文的截止时间，返回用于恢复的token"""
+    return _deadline.set(None if timeout is None else time.monotonic() + timeout)
+
+
+def reset_deadline(token):
+    """恢复之前的截止时间"""
+    _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """剩余时间(秒)，未设置截止时间时返回None"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def cap(timeout: Optional[float]) -> Optional[float]:
+    """将阶段超时限制在剩余时间内"""
+    left = remaining()
+    if left is None:
+        return timeout
+    if timeout is None:
+        return max(left, 0.0)
+    return max(min(timeout, left), 0.0)
+
+
+def check(stage: str):
+    """截止时间已过时立即放弃后续工作"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise HTTPException(status_code=504, detail=f"请求已超过截止时间: {stage}")
+
+
+async def run(awaitable: Awaitable[T], timeout: Optional[float], stage: str) -> T:
+    """在阶段超时与请求截止时间的较小值内执行，超时返回504"""
+    try:
+        check(stage)
+    except HTTPException:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+    limit = cap(timeout)
+    try:
+        return await asyncio.wait_for(awaitable, limit)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"{stage}超时({limit:.1f}s)")
+
+
+def parse_headers(headers) -> Optional[float]:
+    """从请求头解析剩余超时时间(秒)，格式错误时抛出ValueError"""
+    timeouts = []
+    for key, value in headers:
+        key = key.lower()
+        if key == TIMEOUT_HEADER:
+            timeouts.append(float(value))
+        elif key == DEADLINE_HEADER:
+            timeouts.append(float(value) - time.time())
+    return min(timeouts) if timeouts else None
+
+
+class DeadlineMiddleware:
+    """ASGI中间件：为每个请求建立截止时间上下文"""
+
+    def __init__(self, app, default_timeout: float = 0):
+        self.app = app
+        self.default_timeout = default_timeout or None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            timeout = parse_headers(scope["headers"])
+        except ValueError:
+            await send_error(send, 400, "截止时间请求头格式错误")
+            return
+        if timeout is None:
+            timeout = self.default_timeout
+        elif self.default_timeout:
+            timeout = min(timeout, self.default_timeout)
+
+        if timeout is not None and timeout <= 0:
+            await send_error(send, 504, "请求到达时已超过截止时间")
+            return
+
+        token = set_deadline(timeout)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            reset_deadline(token)
@@ -10,7 +10,13 @@ import uvicorn
 import sys
 
 from .config import config
-from .api import chat, models
+from .compression import CompressionMiddleware
+from .capture import CaptureMiddleware, TrafficRecorder
+from .deadline import DeadlineMiddleware
+from .profiling import RequestProfileMiddleware, loop_monitor
+from .services.http_client import close_client
+from .services.warmup import warmup_manager
+from .api import chat, models, embeddings, admin, ws
 
 # 配置日志
 logger.remove()
@@ -38,6 +44,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 流量采集(按需开启，关闭时不挂载中间件)
+traffic_recorder = TrafficRecorder(config.capture)
+if config.capture.enabled:
+    app.add_middleware(CaptureMiddleware, recorder=traffic_recorder)
+
+# 按请求cProfile追踪(采样率为0或未配置管理密钥时不挂载中间件，结果只能通过管理接口查看)
+if config.profiling.request_profile_sample_rate > 0 and config.auth.admin_keys:
+    app.add_middleware(RequestProfileMiddleware, settings=config.profiling)
+
+# 添加压缩中间件(响应压缩协商 + 压缩请求体解压)
+app.add_middleware(CompressionMiddleware, settings=config.compression)
+
+# 添加截止时间中间件(解析X-Request-Timeout / X-Request-Deadline)
+app.add_middleware(DeadlineMiddleware, default_timeout=config.server.default_request_timeout)
+
 
 # 全局异常处理
 @app.exception_handler(HTTPException)
@@ -78,6 +99,12 @@ async def startup_event():
     logger.info("LLM网关服务启动中...")
     logger.info(f"配置文件: {config.config_path}")
     logger.info(f"可用模型数量: {len(config.get_all_models())}")
+    if config.capture.enabled:
+        traffic_recorder.start()
+    if config.profiling.loop_monitor:
+        loop_monitor.start()
+    # 后台预热上游连接和token，完成前 /v1/ready 返回503
+    warmup_manager.start()
     logger.info("LLM网关服务启动完成")
 
 
@@ -86,6 +113,11 @@ async def startup_event():
 async def shutdown_event():
     """应用关闭事件"""
     logger.info("LLM网关服务正在关闭...")
+    await warmup_manager.stop()
+    await loop_monitor.stop()
+    if config.capture.enabled:
+        await traffic_recorder.stop()
+    await close_client()
 
 
 # 根路径
@@ -97,13 +129,18 @@ async def root():
         "version": "1.0.0",
         "description": "大模型网关服务",
         "docs": "/docs",
-        "health": "/v1/health"
+        "health": "/v1/health",
+        "ready": "/v1/ready"
     }
 
 
 # 注册路由
 app.include_router(chat.router)
 app.include_router(models.router)
+app.include_router(embeddings.router)
+app.include_router(admin.router)
+if config.websocket.enabled:
+    app.include_router(ws.router)
 
 
 def start_server(host: str = None, port: int = None, reload: bool = False):
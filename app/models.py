@@ -20,6 +20,7 @@ class ChatCompletionRequest(BaseModel):
     temperature: Optional[float] = Field(0.7, description="温度参数")
     top_p: Optional[float] = Field(1.0, description="top_p参数")
     stream: Optional[bool] = Field(False, description="是否流式输出")
+    session_id: Optional[str] = Field(None, max_length=128, description="会话ID，携带时messages只需包含新消息")
 
 
 class ChatCompletionResponse(BaseModel):
@@ -32,6 +33,14 @@ class ChatCompletionResponse(BaseModel):
     usage: Dict[str, int] = Field(..., description="使用统计")
 
 
+class EmbeddingRequest(BaseModel):
+    """嵌入请求模型"""
+    model: str = Field(..., description="模型名称")
+    input: Union[str, List[str]] = Field(..., description="输入文本或文本列表")
+    encoding_format: Optional[str] = Field("float", description="向量格式: float, base64")
+    user: Optional[str] = Field(None, description="调用方标识")
+
+
 class ModelInfo(BaseModel):
     """模型信息模型"""
     id: str = Field(..., description="模型ID")
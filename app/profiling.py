@@ -0,0 +1,271 @@
+"""
+性能剖析模块
+提供限时采样剖析(折叠栈/火焰图格式)、事件循环延迟监控和按请求的cProfile追踪。
+未开启时不挂载任何钩子，开销为零。
+"""
+import asyncio
+import cProfile
+import io
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from loguru import logger
+
+from .config import ProfilingConfig, config
+
+# 事件循环延迟直方图的桶上限(毫秒)
+LAG_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000]
+
+
+def _format_stack(frame, limit: int = 64) -> List[str]:
+    """将栈帧转换为从外到内的 'function (file:line)' 列表"""
+    stack = []
+    while frame is not None and len(stack) < limit:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class SamplingProfiler:
+    """基于sys._current_frames()的采样剖析器，输出折叠栈格式(可直接用于flamegraph.pl/speedscope)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def sample(self, seconds: float, interval: float, thread_id: Optional[int] = None) -> str:
+        """在当前线程中阻塞采样，返回折叠栈文本；thread_id为None时采样除自身外的所有线程"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("已有采样剖析正在进行")
+        try:
+            own_id = threading.get_ident()
+            stacks: Counter = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for tid, frame in sys._current_frames().items():
+                    if tid == own_id or (thread_id is not None and tid != thread_id):
+                        continue
+                    frames = ";".join(
+                        f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]})"
+                        for code in self._codes(frame)
+                    )
+                    stacks[frames] += 1
+                time.sleep(interval)
+            return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _codes(frame):
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        return codes
+
+
+class LoopLagMonitor:
+    """
+    事件循环延迟监控
+    - 循环内定时任务测量调度延迟并计入直方图
+    - 看门狗线程在循环超过阈值未响应时抓取循环线程的调用栈，定位阻塞的慢回调
+    """
+
+    def __init__(self, settings: ProfilingConfig):
+        self.settings = settings
+        self.histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.max_lag_ms = 0.0
+        self.total_lag_ms = 0.0
+        self.slow_callbacks: Deque[Dict[str, Any]] = deque(maxlen=settings.slow_callback_history)
+        self._heartbeat = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """启动监控(需在事件循环中调用)"""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info("事件循环延迟监控已开启")
+
+    async def stop(self):
+        """停止监控"""
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("事件循环延迟监控已关闭")
+
+    async def _tick(self):
+        interval = self.settings.loop_monitor_interval
+        while True:
+            expected = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            self._observe(max(0.0, now - expected) * 1000)
+
+    def _observe(self, lag_ms: float):
+        index = len(LAG_BUCKETS_MS)
+        for i, bound in enumerate(LAG_BUCKETS_MS):
+            if lag_ms <= bound:
+                index = i
+                break
+        self.histogram[index] += 1
+        self.samples += 1
+        self.total_lag_ms += lag_ms
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+
+    def _watch(self):
+        """看门狗线程：循环阻塞超过阈值时记录一次调用栈"""
+        threshold = self.settings.slow_callback_threshold
+        interval = self.settings.loop_monitor_interval
+        reported_heartbeat = None
+        while not self._stop.wait(threshold / 2):
+            blocked = time.monotonic() - self._heartbeat - interval
+            if blocked < threshold:
+                continue
+            if reported_heartbeat == self._heartbeat:
+                # 同一次阻塞只记录一次，持续更新阻塞时长
+                self.slow_callbacks[-1]["blocked_ms"] = round(blocked * 1000, 1)
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            reported_heartbeat = self._heartbeat
+            self.slow_callbacks.append({
+                "time": time.time(),
+                "blocked_ms": round(blocked * 1000, 1),
+                "stack": _format_stack(frame),
+            })
+
+    def get_stats(self) -> Dict[str, Any]:
+        buckets = {f"<={bound}ms": self.histogram[i] for i, bound in enumerate(LAG_BUCKETS_MS)}
+        buckets[f">{LAG_BUCKETS_MS[-1]}ms"] = self.histogram[-1]
+        return {
+            "running": self.running,
+            "samples": self.samples,
+            "mean_lag_ms": round(self.total_lag_ms / self.samples, 3) if self.samples else 0.0,
+            "max_lag_ms": round(self.max_lag_ms, 3),
+            "histogram": buckets,
+            "slow_callbacks": list(self.slow_callbacks),
+        }
+
+
+class RequestProfileMiddleware:
+    """
+    按请求cProfile追踪的ASGI中间件
+    携带X-Profile请求头的请求按采样率进行剖析，结果通过响应头X-Profile-Id返回，
+    在/admin/profiles/{id}查看。cProfile作用于事件循环线程，期间并发执行的其他协程也会计入，
+    因此同一时间只剖析一个请求。
+    """
+
+    def __init__(self, app, settings: ProfilingConfig):
+        self.app = app
+        self.settings = settings
+        self._active = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._active or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+        if random.random() >= self.settings.request_profile_sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex[:12]
+
+        async def profiled_send(message):
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 其他剖析器已在运行
+            await self.app(scope, receive, send)
+            return
+
+        self._active = True
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            profiler.disable()
+            self._active = False
+            store_request_profile(profile_id, scope["path"], time.perf_counter() - started, profiler)
+
+    @staticmethod
+    def _requested(scope) -> bool:
+        for key, value in scope["headers"]:
+            if key == b"x-profile":
+                return value.lower() in (b"1", b"true", b"yes")
+        return False
+
+
+# 最近的请求剖析结果
+_request_profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def store_request_profile(profile_id: str, path: str, duration: float, profiler: cProfile.Profile):
+    """保存请求剖析结果(pstats文本)"""
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats("cumulative").print_stats(config.profiling.request_profile_top)
+    _request_profiles[profile_id] = {
+        "id": profile_id,
+        "path": path,
+        "time": time.time(),
+        "duration_ms": round(duration * 1000, 3),
+        "stats": stream.getvalue(),
+    }
+    while len(_request_profiles) > config.profiling.request_profile_history:
+        _request_profiles.popitem(last=False)
+
+
+def list_request_profiles() -> List[Dict[str, Any]]:
+    return [
+        {k: v for k, v in profile.items() if k != "stats"}
+        for profile in reversed(_request_profiles.values())
+    ]
+
+
+def get_request_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    return _request_profiles.get(profile_id)
+
+
+# 全局实例
+sampling_profiler = SamplingProfiler()
+loop_monitor = LoopLagMonitor(config.profiling)
@@ -0,0 +1,256 @@
+"""
+流量回放模块
+按原始时间间隔(或缩放/最大速度)将采集文件重新发送到网关，可搭配本地模拟上游，
+用于在CI中复现生产负载形态并对比不同构建的延迟分布
+"""
+import asyncio
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from loguru import logger
+
+from .config import config
+from .services.timeouts import LatencyTracker
+
+
+def load_capture(paths: List[str]) -> List[Dict[str, Any]]:
+    """读取采集文件(支持目录)，按到达时间排序，跳过没有请求体的记录"""
+    files: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(".jsonl")
+            )
+        else:
+            files.append(path)
+
+    records = []
+    skipped = 0
+    for file in files:
+        with open(file, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("body") is None:
+                    skipped += 1
+                    continue
+                records.append(record)
+    records.sort(key=lambda r: r["ts"])
+    logger.info(f"加载采集记录: {len(records)}条, 跳过{skipped}条(无请求体), 文件数: {len(files)}")
+    return records
+
+
+def create_mock_upstream(latency_ms: float = 50.0, reply_chars: int = 200, stream_chunks: int = 10) -> FastAPI:
+    """创建模拟上游服务(OpenAI兼容)，固定延迟返回固定长度的回复"""
+    mock = FastAPI(title="Mock Upstream")
+    reply = "模" * reply_chars
+
+    @mock.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        data = await request.json()
+        if data.get("stream"):
+            async def generate():
+                step = len(reply) // stream_chunks or 1
+                for i in range(0, len(reply), step):
+                    await asyncio.sleep(latency_ms / 1000 / stream_chunks)
+                    chunk = {"choices": [{"index": 0, "delta": {"content": reply[i:i + step]}}]}
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(generate(), media_type="text/event-stream")
+
+        await asyncio.sleep(latency_ms / 1000)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": data.get("model", ""),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": reply_chars, "total_tokens": reply_chars},
+        }
+
+    @mock.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        data = await request.json()
+        inputs = data["input"] if isinstance(data["input"], list) else [data["input"]]
+        await asyncio.sleep(latency_ms / 1000)
+        return {
+            "object": "list",
+            "data": [{"object": "embedding", "index": i, "embedding": [0.0] * 256} for i in range(len(inputs))],
+            "model": data.get("model", ""),
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        }
+
+    @mock.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": []}
+
+    return mock
+
+
+async def replay(records: List[Dict[str, Any]], target: str, api_key: str,
+                 speed: float = 1.0, concurrency: int = 100) -> List[Dict[str, Any]]:
+    """
+    回放采集记录
+    speed > 0 时按原始到达间隔除以speed调度；speed <= 0 时以最大速度发送(受concurrency限制)
+    """
+    if not records:
+        return []
+
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    results: List[Dict[str, Any]] = []
+    first_ts = records[0]["ts"]
+
+    async with httpx.AsyncClient(base_url=target, headers=headers, limits=limits, timeout=None) as client:
+
+        async def send(record: Dict[str, Any], lag: float):
+            async with semaphore:
+                result = {
+                    "model": record.get("model"),
+                    "stream": bool(record.get("stream")),
+                    "lag_ms": round(lag * 1000, 3),
+                    "original_latency_ms": record.get("latency_ms"),
+                }
+                started = time.perf_counter()
+                ttfb = None
+                try:
+                    async with client.stream("POST", record["path"], json=record["body"]) as response:
+                        async for _ in response.aiter_raw():
+                            if ttfb is None:
+                                ttfb = time.perf_counter() - started
+                        result["status"] = response.status_code
+                except httpx.HTTPError as e:
+                    result["status"] = 0
+                    result["error"] = f"{type(e).__name__}: {e}"
+                latency = time.perf_counter() - started
+                result["latency_ms"] = round(latency * 1000, 3)
+                result["ttfb_ms"] = round((ttfb or latency) * 1000, 3)
+                results.append(result)
+
+        tasks = []
+        start = time.perf_counter()
+        for record in records:
+            lag = 0.0
+            if speed > 0:
+                due = start + (record["ts"] - first_ts) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                lag = max(0.0, time.perf_counter() - due)
+            tasks.append(asyncio.create_task(send(record, lag)))
+        await asyncio.gather(*tasks)
+
+    return results
+
+
+def _percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "p50": LatencyTracker.percentile(samples, 0.5),
+        "p90": LatencyTracker.percentile(samples, 0.9),
+        "p99": LatencyTracker.percentile(samples, 0.99),
+        "max": max(samples) if samples else None,
+        "mean": round(sum(samples) / len(samples), 3) if samples else None,
+    }
+
+
+def summarize(results: List[Dict[str, Any]], wall_time: float) -> Dict[str, Any]:
+    """汇总回放结果的延迟分布"""
+    ok = [r for r in results if r["status"] == 200]
+    by_model: Dict[str, List[float]] = defaultdict(list)
+    for r in ok:
+        by_model[r["model"] or "-"].append(r["latency_ms"])
+
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": len(results) - len(ok),
+        "status": dict(Counter(str(r["status"]) for r in results)),
+        "wall_time_s": round(wall_time, 3),
+        "throughput_rps": round(len(results) / wall_time, 2) if wall_time > 0 else 0.0,
+        "latency_ms": _percentiles([r["latency_ms"] for r in ok]),
+        "ttfb_ms": _percentiles([r["ttfb_ms"] for r in ok]),
+        "schedule_lag_ms": _percentiles([r["lag_ms"] for r in results]),
+        "models": {
+            model: {"count": len(samples), "p50": LatencyTracker.percentile(samples, 0.5),
+                    "p99": LatencyTracker.percentile(samples, 0.99)}
+            for model, samples in by_model.items()
+        },
+    }
+
+
+def compare(summary: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """对比基线，返回每个分位数的对比结果，regression表示变化超出阈值"""
+    rows = []
+    for metric in ("latency_ms", "ttfb_ms"):
+        for key in ("p50", "p90", "p99"):
+            current = summary[metric].get(key)
+            base = baseline.get(metric, {}).get(key)
+            if not current or not base:
+                continue
+            change = (current - base) / base
+            rows.append({
+                "metric": f"{metric}.{key}",
+                "baseline": base,
+                "current": current,
+                "change": change,
+                "regression": change > threshold,
+            })
+    return rows
+
+
+async def _start_server(app, port: int) -> Tuple[uvicorn.Server, asyncio.Task]:
+    """在当前事件循环中启动uvicorn服务"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server.install_signal_handlers = lambda: None
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()  # 启动失败时抛出异常
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def run_replay(paths: List[str], speed: float = 1.0, target: Optional[str] = None,
+                     api_key: Optional[str] = None, mock_upstream: bool = False,
+                     mock_latency_ms: float = 50.0, gateway_port: int = 18080, mock_port: int = 18081,
+                     concurrency: int = 100) -> Dict[str, Any]:
+    """
+    回放入口
+    未指定target时在进程内启动网关；mock_upstream为True时同时启动模拟上游，并将所有模型指向它
+    """
+    records = load_capture(paths)
+    servers = []
+
+    if mock_upstream:
+        servers.append(await _start_server(create_mock_upstream(mock_latency_ms), mock_port))
+        for model in config.get_all_models():
+            model.base_url = f"http://127.0.0.1:{mock_port}/v1"
+            model.replicas = []
+            if model.type == "request":
+                model.token = "mock-token"
+        logger.info(f"模拟上游已启动: http://127.0.0.1:{mock_port}, 延迟: {mock_latency_ms}ms")
+
+    if target is None:
+        from .main import app as gateway_app
+        servers.append(await _start_server(gateway_app, gateway_port))
+        target = f"http://127.0.0.1:{gateway_port}"
+        logger.info(f"网关已在进程内启动: {target}")
+
+    api_key = api_key or (config.auth.api_keys[0] if config.auth.api_keys else "")
+    try:
+        started = time.perf_counter()
+        results = await replay(records, target, api_key, speed, concurrency)
+        return summarize(results, time.perf_counter() - started)
+    finally:
+        for server, _ in servers:
+            server.should_exit = True
+        await asyncio.gather(*(task for _, task in servers))
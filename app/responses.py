@@ -0,0 +1,22 @@
+"""
+ASGI响应工具
+供纯ASGI中间件在进入应用之前直接返回错误
+"""
+import json
+
+
+async def send_error(send, status_code: int, message: str):
+    """发送与全局异常处理格式一致的错误响应"""
+    body = json.dumps(
+        {"error": {"message": message, "type": "http_error", "code": status_code}},
+        ensure_ascii=False,
+    ).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
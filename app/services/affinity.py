@@ -0,0 +1,158 @@
+"""
+前缀亲和路由模块
+将相同系统提示词/对话前缀的请求一致性哈希到同一个模型副本，提高后端前缀缓存(KV cache)命中率
+"""
+import bisect
+import hashlib
+import math
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from cachetools import LRUCache
+from loguru import logger
+
+from ..config import ModelConfig
+
+
+def _hash64(data: bytes) -> int:
+    """64位哈希"""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def prefix_key(messages: Sequence, prefix_turns: int) -> int:
+    """
+    计算消息前缀的哈希
+    前缀 = 全部系统消息 + 前N条非系统消息，内容做空白归一化
+    """
+    hasher = hashlib.blake2b(digest_size=8)
+    turns = 0
+    for msg in messages:
+        role, content = (msg["role"], msg["content"]) if isinstance(msg, dict) else (msg.role, msg.content)
+        if role != "system":
+            if turns >= prefix_turns:
+                break
+            turns += 1
+        hasher.update(role.encode("utf-8"))
+        hasher.update(b"\x00")
+        hasher.update(" ".join(content.split()).encode("utf-8"))
+        hasher.update(b"\x01")
+    return int.from_bytes(hasher.digest(), "big")
+
+
+class ConsistentHashRing:
+    """带虚拟节点的一致性哈希环"""
+
+    def __init__(self, nodes: List[str], virtual_nodes: int = 100):
+        self.nodes = list(nodes)
+        self._ring: List[Tuple[int, str]] = sorted(
+            (_hash64(f"{node}#{i}".encode("utf-8")), node)
+            for node in self.nodes
+            for i in range(virtual_nodes)
+        )
+        self._keys = [h for h, _ in self._ring]
+
+    def iter_nodes(self, key: int) -> Iterator[str]:
+        """从key所在位置顺时针遍历，依次返回不重复的节点"""
+        if not self._ring:
+            return
+        seen = set()
+        start = bisect.bisect(self._keys, key)
+        for offset in range(len(self._ring)):
+            node = self._ring[(start + offset) % len(self._ring)][1]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+
+class PrefixAffinityRouter:
+    """
+    前缀亲和路由器
+    使用有界负载一致性哈希：单个副本的在途请求数不超过
+    ceil(load_factor * (总在途请求数 + 1) / 副本数)，超出时顺时针溢出到下一个副本
+    """
+
+    def __init__(self, model_config: ModelConfig):
+        self.model_name = model_config.name
+        self.replicas = list(model_config.replicas)
+        self.prefix_turns = model_config.affinity_prefix_turns
+        self.load_factor = model_config.affinity_load_factor
+        self.ring = ConsistentHashRing(self.replicas, model_config.affinity_virtual_nodes)
+        self.inflight: Dict[str, int] = {replica: 0 for replica in self.replicas}
+        # 记录前缀最近一次被路由到的副本，用于统计前缀缓存命中
+        self._last_replica: LRUCache = LRUCache(maxsize=model_config.affinity_tracked_prefixes)
+        self.stats = {
+            "requests": 0,
+            "home_routed": 0,  # 路由到哈希环上的首选副本
+            "spillovers": 0,  # 因负载上限溢出到其他副本
+            "prefix_hits": 0,  # 与该前缀上次请求落在同一副本(缓存预计为热)
+            "prefix_misses": 0,  # 前缀曾出现但落在不同副本
+            "new_prefixes": 0,
+        }
+
+    def _capacity(self) -> int:
+        total = sum(self.inflight.values())
+        return max(1, math.ceil(self.load_factor * (total + 1) / len(self.replicas)))
+
+    def acquire(self, messages: Sequence) -> str:
+        """为请求选择副本并增加其在途计数，调用方必须在完成后调用release"""
+        key = prefix_key(messages, self.prefix_turns)
+        capacity = self._capacity()
+
+        chosen = None
+        for index, replica in enumerate(self.ring.iter_nodes(key)):
+            if self.inflight[replica] < capacity:
+                chosen = replica
+                self.stats["home_routed" if index == 0 else "spillovers"] += 1
+                break
+        if chosen is None:
+            # 所有副本都已满载(理论上不会发生)，退化为最小负载
+            chosen = min(self.replicas, key=lambda r: self.inflight[r])
+            self.stats["spillovers"] += 1
+
+        previous = self._last_replica.get(key)
+        if previous is None:
+            self.stats["new_prefixes"] += 1
+        elif previous == chosen:
+            self.stats["prefix_hits"] += 1
+        else:
+            self.stats["prefix_misses"] += 1
+        self._last_replica[key] = chosen
+
+        self.stats["requests"] += 1
+        self.inflight[chosen] += 1
+        return chosen
+
+    def release(self, replica: str):
+        """请求完成，减少副本在途计数"""
+        if self.inflight.get(replica, 0) > 0:
+            self.inflight[replica] -= 1
+
+    def get_stats(self) -> Dict:
+        """获取路由统计"""
+        seen = self.stats["prefix_hits"] + self.stats["prefix_misses"]
+        return {
+            **self.stats,
+            "prefix_hit_rate": round(self.stats["prefix_hits"] / seen, 4) if seen else 0.0,
+            "inflight": dict(self.inflight),
+            "replicas": self.replicas,
+        }
+
+
+# 按模型名称缓存的路由器
+_routers: Dict[str, PrefixAffinityRouter] = {}
+
+
+def get_router(model_config: ModelConfig) -> PrefixAffinityRouter:
+    """获取模型的前缀亲和路由器(副本列表变化时重建)"""
+    router = _routers.get(model_config.name)
+    if router is None or router.replicas != list(model_config.replicas):
+        router = PrefixAffinityRouter(model_config)
+        _routers[model_config.name] = router
+        logger.info(f"创建前缀亲和路由: {model_config.name}, 副本数: {len(router.replicas)}")
+    return router
+
+
+def get_all_stats() -> Dict[str, Dict]:
+    """获取所有前缀亲和路由器的统计信息"""
+    return {name: router.get_stats() for name, router in _routers.items()}
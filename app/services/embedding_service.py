@@ -0,0 +1,193 @@
+"""
+嵌入服务模块
+将并发的小嵌入请求在短时间窗口内合并为一次上游批量调用，再拆分回各调用方；
+可选按输入哈希缓存向量，向量以float32数组紧凑存储
+"""
+import asyncio
+import base64
+import hashlib
+import sys
+from array import array
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from cachetools import LRUCache
+from fastapi import HTTPException
+from loguru import logger
+
+from ..config import ModelConfig, config
+from ..models import EmbeddingRequest
+from .. import deadline
+from .llm_service import LLMService
+
+
+class EmbeddingBatcher:
+    """单个模型的动态微批处理器"""
+
+    def __init__(self, model_config: ModelConfig):
+        self.model_config = model_config
+        self.max_batch_size = max(1, model_config.embedding_batch_size)
+        self.max_wait = model_config.embedding_max_wait_ms / 1000
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 进行中的批量调用(事件循环只保留任务的弱引用，需持有引用避免执行中被回收)
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"requests": 0, "inputs": 0, "batches": 0, "upstream_inputs": 0}
+
+    async def embed(self, texts: List[str]) -> List[Tuple[array, int]]:
+        """提交一组输入，返回对应的(向量, token数)"""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self._pending.append((text, future))
+            futures.append(future)
+        self.stats["requests"] += 1
+        self.stats["inputs"] += len(texts)
+
+        while len(self._pending) >= self.max_batch_size:
+            self._flush()
+        if self._pending and self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await deadline.run(asyncio.gather(*futures), None, "等待批量嵌入")
+
+    def _flush(self):
+        """取出最多max_batch_size条输入，启动一次上游调用"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = self._pending[:self.max_batch_size]
+        self._pending = self._pending[self.max_batch_size:]
+        # 跳过调用方已放弃(超时/取消)的输入
+        batch = [(text, future) for text, future in batch if not future.done()]
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if self._pending and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        # 批量调用服务于多个调用方，不受触发它的那个请求的截止时间约束
+        token = deadline.set_deadline(None)
+        try:
+            # 同一批次内相同输入只发送一次
+            unique = list(dict.fromkeys(text for text, _ in batch))
+            self.stats["batches"] += 1
+            self.stats["upstream_inputs"] += len(unique)
+            response = await LLMService.embeddings(self.model_config, unique)
+
+            vectors: Dict[str, array] = {}
+            for item in response["data"]:
+                vectors[unique[item["index"]]] = array("f", item["embedding"])
+            if len(vectors) != len(unique):
+                raise HTTPException(status_code=502, detail=f"上游嵌入结果数量不匹配: {self.model_config.name}")
+
+            # 按字符数比例分摊上游返回的token数
+            prompt_tokens = response.get("usage", {}).get("prompt_tokens", 0)
+            total_chars = sum(len(text) for text in unique) or 1
+            for text, future in batch:
+                if not future.done():
+                    future.set_result((vectors[text], round(prompt_tokens * len(text) / total_chars)))
+        except Exception as e:
+            if not isinstance(e, HTTPException):
+                logger.error(f"批量嵌入调用失败: {self.model_config.name}, {e}")
+                e = HTTPException(status_code=500, detail=f"嵌入调用失败: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            deadline.reset_deadline(token)
+
+
+class EmbeddingService:
+    """嵌入服务统一调用类"""
+
+    _batchers: Dict[str, EmbeddingBatcher] = {}
+    _caches: Dict[str, LRUCache] = {}
+
+    @staticmethod
+    def _get_batcher(model_config: ModelConfig) -> EmbeddingBatcher:
+        batcher = EmbeddingService._batchers.get(model_config.name)
+        if batcher is None or batcher.model_config is not model_config:
+            batcher = EmbeddingBatcher(model_config)
+            EmbeddingService._batchers[model_config.name] = batcher
+        return batcher
+
+    @staticmethod
+    def _get_cache(model_config: ModelConfig) -> Optional[LRUCache]:
+        if model_config.embedding_cache_size <= 0:
+            return None
+        cache = EmbeddingService._caches.get(model_config.name)
+        if cache is None:
+            cache = LRUCache(maxsize=model_config.embedding_cache_size)
+            EmbeddingService._caches[model_config.name] = cache
+        return cache
+
+    @staticmethod
+    def _cache_key(model_config: ModelConfig, text: str) -> bytes:
+        return hashlib.sha256(f"{model_config.name}\x00{text}".encode("utf-8")).digest()
+
+    @staticmethod
+    async def create_embeddings(request: EmbeddingRequest) -> Dict[str, Any]:
+        """OpenAI兼容的嵌入接口"""
+        try:
+            model_config = config.get_model_by_name(request.model)
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+
+        texts = [request.input] if isinstance(request.input, str) else list(request.input)
+        if not texts:
+            raise HTTPException(status_code=400, detail="input不能为空")
+        if request.encoding_format not in ("float", "base64"):
+            raise HTTPException(status_code=400, detail=f"不支持的encoding_format: {request.encoding_format}")
+
+        # 先查缓存，只把未命中的输入交给批处理器
+        cache = EmbeddingService._get_cache(model_config)
+        results: List[Optional[Tuple[array, int]]] = [None] * len(texts)
+        missing: List[int] = []
+        for i, text in enumerate(texts):
+            cached = cache.get(EmbeddingService._cache_key(model_config, text)) if cache is not None else None
+            if cached is not None:
+                results[i] = (cached, 0)
+            else:
+                missing.append(i)
+
+        if missing:
+            embedded = await EmbeddingService._get_batcher(model_config).embed([texts[i] for i in missing])
+            for i, (vector, tokens) in zip(missing, embedded):
+                results[i] = (vector, tokens)
+                if cache is not None:
+                    cache[EmbeddingService._cache_key(model_config, texts[i])] = vector
+
+        prompt_tokens = sum(tokens for _, tokens in results)
+        return {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": _encode(vector, request.encoding_format)}
+                for i, (vector, _) in enumerate(results)
+            ],
+            "model": model_config.name,
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+        }
+
+    @staticmethod
+    def get_stats() -> Dict[str, Any]:
+        """批处理与缓存统计"""
+        return {
+            name: {
+                **batcher.stats,
+                "cache_size": len(EmbeddingService._caches[name]) if name in EmbeddingService._caches else 0,
+            }
+            for name, batcher in EmbeddingService._batchers.items()
+        }
+
+
+def _encode(vector: array, encoding_format: str):
+    """按encoding_format输出：float为数字列表，base64为小端float32字节"""
+    if encoding_format == "base64":
+        if sys.byteorder != "little":
+            vector = array("f", vector)
+            vector.byteswap()
+        return base64.b64encode(vector.tobytes()).decode("ascii")
+    return vector.tolist()
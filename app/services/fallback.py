@@ -0,0 +1,97 @@
+"""
+模型回退模块
+虚拟模型名解析为有序回退链或加权模型池；调用遇到可重试错误时在网关内切换到下一个模型，
+整个过程受原请求的截止时间约束。实际提供服务的模型名通过served_model记录，由路由写入响应头。
+"""
+import random
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from fastapi import HTTPException
+from loguru import logger
+
+from ..config import AliasConfig, ModelConfig, config
+from .. import deadline
+
+T = TypeVar("T")
+
+# 当前请求实际提供服务的模型
+served_model: ContextVar[Optional[str]] = ContextVar("served_model", default=None)
+
+_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def resolve(name: str) -> Tuple[Optional[AliasConfig], List[ModelConfig]]:
+    """将模型名解析为(虚拟模型配置, 按尝试顺序排列的模型)，真实模型返回(None, [模型])"""
+    alias = config.get_alias(name)
+    if alias is None:
+        try:
+            return None, [config.get_model_by_name(name)]
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+
+    targets = alias.models
+    if alias.strategy == "weighted":
+        targets = _weighted_order(targets)
+    elif alias.strategy != "fallback":
+        raise HTTPException(status_code=500, detail=f"不支持的虚拟模型策略: {alias.strategy}")
+
+    candidates = []
+    for target in targets:
+        try:
+            candidates.append(config.get_model_by_name(target.model))
+        except ValueError:
+            # 未启用的目标直接跳过，不占用尝试次数
+            continue
+    if alias.max_attempts > 0:
+        candidates = candidates[:alias.max_attempts]
+    if not candidates:
+        raise HTTPException(status_code=503, detail=f"虚拟模型没有可用的目标模型: {name}")
+    return alias, candidates
+
+
+def _weighted_order(targets):
+    """按权重无放回抽样，得到本次请求的尝试顺序"""
+    remaining = [target for target in targets if target.weight > 0]
+    ordered = []
+    while remaining:
+        target = random.choices(remaining, weights=[t.weight for t in remaining])[0]
+        remaining.remove(target)
+        ordered.append(target)
+    return ordered
+
+
+async def call(name: str, attempt: Callable[[ModelConfig], Awaitable[T]]) -> T:
+    """按解析顺序调用attempt，遇到可重试错误且截止时间未到时回退到下一个模型"""
+    alias, candidates = resolve(name)
+    stats = None
+    if alias is not None:
+        stats = _stats.setdefault(name, {"requests": 0, "failovers": 0, "exhausted": 0, "served": Counter()})
+        stats["requests"] += 1
+
+    for i, model_config in enumerate(candidates):
+        try:
+            result = await attempt(model_config)
+        except HTTPException as e:
+            if stats is None or e.status_code not in alias.retry_on:
+                raise
+            left = deadline.remaining()
+            if i == len(candidates) - 1 or (left is not None and left <= 0):
+                stats["exhausted"] += 1
+                raise
+            stats["failovers"] += 1
+            logger.warning(
+                f"模型调用失败，回退到下一个模型: {name}, "
+                f"{model_config.name} -> {candidates[i + 1].name}, 状态码: {e.status_code}"
+            )
+            continue
+        served_model.set(model_config.name)
+        if stats is not None:
+            stats["served"][model_config.name] += 1
+        return result
+
+
+def get_all_stats() -> Dict[str, Dict[str, Any]]:
+    """所有虚拟模型的回退统计"""
+    return {name: {**stats, "served": dict(stats["served"])} for name, stats in _stats.items()}
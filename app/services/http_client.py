@@ -0,0 +1,35 @@
+"""
+上游HTTP客户端模块
+所有上游调用共享同一个连接池，避免每次请求重新建立TCP/TLS连接
+"""
+import asyncio
+from typing import Optional
+
+import httpx
+from loguru import logger
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """获取共享客户端(按事件循环懒创建)"""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=60.0)
+        )
+        _client_loop = loop
+        logger.info("创建上游HTTP连接池")
+    return _client
+
+
+async def close_client():
+    """关闭共享客户端"""
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        logger.info("上游HTTP连接池已关闭")
+    _client = None
+    _client_loop = None
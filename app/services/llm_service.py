@@ -2,9 +2,11 @@
 LLM服务模块
 统一处理不同类型的大模型服务调用
 """
+import asyncio
+import json
 import uuid
 import time
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncIterator, Awaitable, Callable, Optional, Set, Tuple
 import httpx
 from loguru import logger
 from fastapi import HTTPException
@@ -12,124 +14,377 @@ from fastapi import HTTPException
 from ..config import ModelConfig, config
 from ..models import ChatCompletionRequest, ChatCompletionResponse, ChatMessage
 from ..auth import TokenManager
+from ..compression import compress_body, upstream_accept_encoding
+from .. import deadline
+from . import fallback, timeouts
+from .affinity import get_router
+from .http_client import get_client
+from .timeouts import UpstreamTimeouts
+
+
+class ClosingStream:
+    """
+    流式响应迭代器，持有上游响应、副本占用等需要释放的资源。
+    aclose()无论迭代是否开始都会执行清理；迭代正常结束或出错时自动清理。
+    StreamingResponse在客户端断开时不会关闭迭代器，调用方需在响应结束后调用aclose()。
+    """
+    
+    def __init__(self, iterator: AsyncIterator[bytes], cleanup: Callable[[], Awaitable[None]]):
+        self._iterator = iterator
+        self._cleanup = cleanup
+        self._closed = False
+    
+    def __aiter__(self) -> "ClosingStream":
+        return self
+    
+    async def __anext__(self) -> bytes:
+        if self._closed:
+            raise StopAsyncIteration
+        try:
+            return await self._iterator.__anext__()
+        except Exception:
+            # 包括StopAsyncIteration；取消不在这里清理：所在任务已被取消，清理中的await会被打断，交给调用方的aclose()
+            await self.aclose()
+            raise
+    
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._iterator.aclose()
+        finally:
+            await self._cleanup()
+    
+    def __del__(self):
+        # 未关闭就被丢弃时，与异步生成器的finalizer一样在事件循环中补做清理
+        if self._closed:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self.aclose())
+        _finalizers.add(task)
+        task.add_done_callback(_finalizers.discard)
+
+
+# 补做清理的任务(保留引用，避免任务执行中被回收)
+_finalizers: Set[asyncio.Task] = set()
 
 
 class LLMService:
     """大模型服务统一调用类"""
     
     @staticmethod
-    async def chat_completion(request: ChatCompletionRequest) -> Dict[str, Any]:
-        """统一的聊天完成接口"""
+    async def chat_completion(request: ChatCompletionRequest,
+                              messages: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+        """统一的聊天完成接口，messages为会话模式下拼接好的完整上下文；虚拟模型在可重试错误时自动回退"""
+        if messages is None:
+            messages = LLMService._messages(request)
+        return await fallback.call(
+            request.model, lambda model_config: LLMService._chat_completion(model_config, request, messages)
+        )
+    
+    @staticmethod
+    async def chat_completion_stream(request: ChatCompletionRequest,
+                                     messages: Optional[List[Dict[str, str]]] = None) -> "ClosingStream":
+        """
+        流式聊天完成接口
+        在上游返回成功响应头后才返回迭代器，之前的错误以HTTPException抛出(虚拟模型可在此之前回退)
+        """
+        if messages is None:
+            messages = LLMService._messages(request)
+        return await fallback.call(
+            request.model, lambda model_config: LLMService._chat_completion_stream(model_config, request, messages)
+        )
+    
+    @staticmethod
+    async def _chat_completion(model_config: ModelConfig, request: ChatCompletionRequest,
+                               messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """调用单个模型的非流式聊天接口"""
         try:
-            # 获取模型配置
-            model_config = config.get_model_by_name(request.model)
-            
-            # 根据模型类型选择调用方式
-            if model_config.type == "openai":
-                return await LLMService._call_openai_api(model_config, request)
-            elif model_config.type == "request":
-                return await LLMService._call_request_api(model_config, request)
-            else:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"不支持的模型类型: {model_config.type}"
+            LLMService._check_type(model_config)
+            router, base_url = LLMService._select_replica(model_config, messages)
+            try:
+                data = LLMService._build_payload(model_config, request, messages)
+                return await LLMService._request_json(model_config, "/chat/completions", data, base_url)
+            finally:
+                if router is not None:
+                    router.release(base_url)
+        
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"调用模型失败: {model_config.name}, {e}")
+            raise HTTPException(status_code=500, detail=f"模型调用失败: {str(e)}")
+    
+    @staticmethod
+    async def _chat_completion_stream(model_config: ModelConfig, request: ChatCompletionRequest,
+                                      messages: List[Dict[str, str]]) -> "ClosingStream":
+        """调用单个模型的流式聊天接口"""
+        try:
+            LLMService._check_type(model_config)
+            router, base_url = LLMService._select_replica(model_config, messages)
+            try:
+                upstream_timeouts = timeouts.resolve(model_config, stream=True)
+                started = time.monotonic()
+                response = await deadline.run(
+                    LLMService._open(model_config, "/chat/completions",
+                                     LLMService._build_payload(model_config, request, messages), base_url, upstream_timeouts),
+                    upstream_timeouts.total, "上游调用"
                 )
+            except BaseException:
+                if router is not None:
+                    router.release(base_url)
+                raise
         
-        except ValueError as e:
-            raise HTTPException(status_code=404, detail=str(e))
+        except HTTPException:
+            raise
         except Exception as e:
-            logger.error(f"调用模型失败: {request.model}, {e}")
+            logger.error(f"调用模型失败: {model_config.name}, {e}")
             raise HTTPException(status_code=500, detail=f"模型调用失败: {str(e)}")
+        
+        first_byte = time.monotonic() - started
+        
+        async def iterate() -> AsyncIterator[bytes]:
+            max_idle = 0.0
+            try:
+                chunks = response.aiter_bytes().__aiter__()
+                while True:
+                    wait_started = time.monotonic()
+                    try:
+                        chunk = await LLMService._next_chunk(chunks, upstream_timeouts, started)
+                    except StopAsyncIteration:
+                        break
+                    max_idle = max(max_idle, time.monotonic() - wait_started)
+                    yield chunk
+                timeouts.record(model_config, True, first_byte, time.monotonic() - started, max_idle)
+            except HTTPException as e:
+                logger.error(f"流式响应中断: {model_config.name}, {e.detail}")
+                yield LLMService._sse_error(e.status_code, e.detail)
+            except httpx.RequestError as e:
+                logger.error(f"流式响应网络错误: {model_config.name}, {e}")
+                yield LLMService._sse_error(502, f"网络请求失败: {model_config.name}, {e}")
+        
+        async def close():
+            if router is not None:
+                router.release(base_url)
+            await response.aclose()
+        
+        return ClosingStream(iterate(), close)
     
     @staticmethod
-    async def _call_openai_api(model_config: ModelConfig, request: ChatCompletionRequest) -> Dict[str, Any]:
-        """调用OpenAI标准格式API"""
-        url = f"{model_config.base_url}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {model_config.api_key}",
-            "Content-Type": "application/json"
-        }
+    async def embeddings(model_config: ModelConfig, texts: List[str]) -> Dict[str, Any]:
+        """调用上游嵌入接口(一次批量请求)"""
+        LLMService._check_type(model_config)
+        data = {"model": model_config.model_name or model_config.name, "input": texts}
+        return await LLMService._request_json(model_config, "/embeddings", data)
+    
+    @staticmethod
+    async def _request_json(model_config: ModelConfig, path: str, data: Dict[str, Any],
+                            base_url: str = "") -> Dict[str, Any]:
+        """发送非流式上游请求并解析JSON响应，受分阶段超时和请求截止时间约束"""
+        upstream_timeouts = timeouts.resolve(model_config, stream=False)
+        started = time.monotonic()
         
-        # 构建请求数据
-        data = {
+        async def call():
+            response = await LLMService._open(model_config, path, data, base_url, upstream_timeouts)
+            first_byte = time.monotonic() - started
+            try:
+                body = await LLMService._read_body(model_config, response, upstream_timeouts, started)
+            finally:
+                await response.aclose()
+            return body, first_byte
+        
+        body, first_byte = await deadline.run(call(), upstream_timeouts.total, "上游调用")
+        timeouts.record(model_config, False, first_byte, time.monotonic() - started)
+        return json.loads(body)
+    
+    @staticmethod
+    def _check_type(model_config: ModelConfig):
+        """校验模型类型"""
+        if model_config.type not in ("openai", "request"):
+            raise HTTPException(
+                status_code=400,
+                detail=f"不支持的模型类型: {model_config.type}"
+            )
+    
+    @staticmethod
+    def _select_replica(model_config: ModelConfig, messages: List[Dict[str, str]]) -> Tuple[Optional[Any], str]:
+        """多副本模型按前缀亲和选择副本，返回(路由器, base_url)"""
+        if model_config.routing == "prefix_affinity" and model_config.replicas:
+            router = get_router(model_config)
+            return router, router.acquire(messages)
+        return None, model_config.base_url
+    
+    @staticmethod
+    def _messages(request: ChatCompletionRequest) -> List[Dict[str, str]]:
+        """请求消息转换为上游格式(直接取字段，避免逐条dict()拷贝)"""
+        return [{"role": msg.role, "content": msg.content} for msg in request.messages]
+    
+    @staticmethod
+    def _build_payload(model_config: ModelConfig, request: ChatCompletionRequest,
+                       messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """构建上游请求数据"""
+        return {
             "model": model_config.model_name or model_config.name,
-            "messages": [msg.dict() for msg in request.messages],
+            "messages": messages,
             "max_tokens": request.max_tokens or model_config.max_tokens,
             "temperature": request.temperature,
             "top_p": request.top_p,
             "stream": request.stream
         }
+    
+    @staticmethod
+    def _encode_body(model_config: ModelConfig, data: Dict[str, Any], headers: Dict[str, str]) -> bytes:
+        """序列化请求体，并按模型配置协商上游压缩(会修改headers)"""
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
         
-        try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(url, headers=headers, json=data)
-                
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    error_msg = f"API调用失败: {response.status_code}, {response.text}"
-                    logger.error(error_msg)
-                    raise HTTPException(status_code=response.status_code, detail=error_msg)
+        max_bytes = model_config.max_request_bytes or config.server.max_request_bytes
+        if len(body) > max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"请求体超过模型大小上限: {model_config.name}, {len(body)} > {max_bytes}字节"
+            )
         
-        except httpx.RequestError as e:
-            error_msg = f"网络请求失败: {model_config.name}, {e}"
-            logger.error(error_msg)
-            raise HTTPException(status_code=500, detail=error_msg)
+        headers["Accept-Encoding"] = upstream_accept_encoding() if model_config.upstream_compression else "identity"
+        
+        encoding = model_config.request_compression
+        if encoding and len(body) >= model_config.request_compression_min_size:
+            body = compress_body(body, encoding)
+            headers["Content-Encoding"] = encoding
+        return body
+    
+    @staticmethod
+    async def _authorization(model_config: ModelConfig) -> str:
+        """获取上游认证头(Request服务需要token认证)"""
+        if model_config.type == "request":
+            token = await TokenManager.get_token(model_config)
+            return f"Bearer {token}"
+        return f"Bearer {model_config.api_key}"
     
     @staticmethod
-    async def _call_request_api(model_config: ModelConfig, request: ChatCompletionRequest) -> Dict[str, Any]:
-        """调用Request服务API（需要token认证）"""
-        # 获取token
-        token = await TokenManager.get_token(model_config)
+    async def _open(model_config: ModelConfig, path: str, data: Dict[str, Any], base_url: str,
+                    upstream_timeouts: UpstreamTimeouts) -> httpx.Response:
+        """发送上游请求并等待响应头，返回状态码为200、尚未读取响应体的响应"""
+        url = f"{base_url or model_config.base_url}{path}"
+        headers = {"Content-Type": "application/json"}
         
-        url = f"{model_config.base_url}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
+        body = LLMService._encode_body(model_config, data, headers)
+        headers["Authorization"] = await LLMService._authorization(model_config)
         
-        # 构建请求数据
-        data = {
-            "model": model_config.model_name or model_config.name,
-            "messages": [msg.dict() for msg in request.messages],
-            "max_tokens": request.max_tokens or model_config.max_tokens,
-            "temperature": request.temperature,
-            "top_p": request.top_p,
-            "stream": request.stream
-        }
+        response = await LLMService._send(model_config, url, headers, body, upstream_timeouts)
         
-        try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(url, headers=headers, json=data)
-                
-                if response.status_code == 200:
-                    return response.json()
-                elif response.status_code == 401:
-                    # Token可能过期，清除缓存并重试
-                    logger.warning(f"Token可能过期，清除缓存: {model_config.name}")
-                    TokenManager.clear_token(model_config.name, model_config.username)
-                    
-                    # 重新获取token并重试
-                    token = await TokenManager.get_token(model_config)
-                    headers["Authorization"] = f"Bearer {token}"
-                    
-                    response = await client.post(url, headers=headers, json=data)
-                    if response.status_code == 200:
-                        return response.json()
-                    else:
-                        error_msg = f"重试后仍失败: {response.status_code}, {response.text}"
-                        logger.error(error_msg)
-                        raise HTTPException(status_code=response.status_code, detail=error_msg)
-                else:
-                    error_msg = f"API调用失败: {response.status_code}, {response.text}"
-                    logger.error(error_msg)
-                    raise HTTPException(status_code=response.status_code, detail=error_msg)
+        if response.status_code == 401 and model_config.type == "request":
+            # Token可能过期，清除缓存并重试
+            await response.aclose()
+            logger.warning(f"Token可能过期，清除缓存: {model_config.name}")
+            TokenManager.clear_token(model_config.name, model_config.username)
+            
+            # 重新获取token并重试
+            headers["Authorization"] = await LLMService._authorization(model_config)
+            response = await LLMService._send(model_config, url, headers, body, upstream_timeouts)
+            if response.status_code != 200:
+                await LLMService._raise_upstream_error(response, "重试后仍失败")
         
+        if response.status_code != 200:
+            await LLMService._raise_upstream_error(response, "API调用失败")
+        return response
+    
+    @staticmethod
+    async def _send(model_config: ModelConfig, url: str, headers: Dict[str, str], body: bytes,
+                    upstream_timeouts: UpstreamTimeouts) -> httpx.Response:
+        """
+        通过共享连接池发送请求，在首字节超时内等待响应头。
+        等待响应头和读取分块的超时分别由外层控制，httpx的读超时取两者较大值，避免限制分块间隔
+        """
+        client = get_client()
+        upstream_request = client.build_request(
+            "POST", url, headers=headers, content=body,
+            timeout=httpx.Timeout(
+                connect=upstream_timeouts.connect,
+                read=max(upstream_timeouts.first_byte, upstream_timeouts.idle),
+                write=upstream_timeouts.idle,
+                pool=upstream_timeouts.connect,
+            )
+        )
+        try:
+            return await deadline.run(
+                client.send(upstream_request, stream=True), upstream_timeouts.first_byte, "等待上游响应"
+            )
+        except httpx.TimeoutException as e:
+            error_msg = f"上游超时: {model_config.name}, {type(e).__name__}"
+            logger.error(error_msg)
+            raise HTTPException(status_code=504, detail=error_msg)
         except httpx.RequestError as e:
             error_msg = f"网络请求失败: {model_config.name}, {e}"
             logger.error(error_msg)
             raise HTTPException(status_code=500, detail=error_msg)
     
+    @staticmethod
+    async def _raise_upstream_error(response: httpx.Response, prefix: str):
+        """读取上游错误响应的前max_error_body_bytes字节并抛出，避免超大错误体进入日志和错误信息"""
+        max_bytes = config.server.max_error_body_bytes
+        head = bytearray()
+        truncated = False
+        try:
+            async for chunk in response.aiter_bytes():
+                head += chunk
+                if len(head) > max_bytes:
+                    truncated = True
+                    break
+        finally:
+            await response.aclose()
+        text = head[:max_bytes].decode(response.encoding or "utf-8", errors="replace")
+        if truncated:
+            text += "...(已截断)"
+        error_msg = f"{prefix}: {response.status_code}, {text}"
+        logger.error(error_msg)
+        raise HTTPException(status_code=response.status_code, detail=error_msg)
+    
+    @staticmethod
+    async def _next_chunk(chunks: AsyncIterator[bytes], upstream_timeouts: UpstreamTimeouts, started: float) -> bytes:
+        """读取下一个数据块，受分块间隔超时和总超时约束"""
+        left = upstream_timeouts.total - (time.monotonic() - started)
+        if left <= 0:
+            raise HTTPException(status_code=504, detail=f"上游调用超时({upstream_timeouts.total:.1f}s)")
+        try:
+            return await deadline.run(chunks.__anext__(), min(upstream_timeouts.idle, left), "读取上游响应")
+        except httpx.TimeoutException as e:
+            raise HTTPException(status_code=504, detail=f"读取上游响应超时: {type(e).__name__}")
+    
+    @staticmethod
+    async def _read_body(model_config: ModelConfig, response: httpx.Response,
+                         upstream_timeouts: UpstreamTimeouts, started: float) -> bytearray:
+        """读取完整响应体(直接返回bytearray，避免再复制一份)，超过响应大小上限时立即中止"""
+        max_bytes = model_config.max_response_bytes or config.server.max_response_bytes
+        content_length = response.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise LLMService._response_too_large(model_config, max_bytes)
+        
+        chunks = response.aiter_bytes().__aiter__()
+        body = bytearray()
+        while True:
+            try:
+                body += await LLMService._next_chunk(chunks, upstream_timeouts, started)
+            except StopAsyncIteration:
+                return body
+            if len(body) > max_bytes:
+                raise LLMService._response_too_large(model_config, max_bytes)
+    
+    @staticmethod
+    def _response_too_large(model_config: ModelConfig, max_bytes: int) -> HTTPException:
+        error_msg = f"上游响应超过大小上限: {model_config.name}, {max_bytes}字节"
+        logger.error(error_msg)
+        return HTTPException(status_code=502, detail=error_msg)
+    
+    @staticmethod
+    def _sse_error(status_code: int, message: str) -> bytes:
+        """构造流式响应中的错误事件"""
+        payload = {"error": {"message": message, "type": "http_error", "code": status_code}}
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+    
     @staticmethod
     async def test_model(model_name: str, test_message: str = "你好") -> Dict[str, Any]:
         """测试模型可用性"""
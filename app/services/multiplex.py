@@ -0,0 +1,260 @@
+"""
+WebSocket多路复用模块
+连接建立时认证一次，之后同一连接上可并发多个带客户端id的聊天请求(流式/非流式)，
+支持按id取消。所有待发送消息经过有界队列，客户端读取过慢时上游读取随之暂停(背压)。
+
+客户端消息:
+    {"type": "auth", "api_key": "..."}                              未携带Authorization头时的首条消息
+    {"type": "request", "id": "r1", "body": {...}, "timeout": 30}   body同/v1/chat/completions，timeout可选(秒)
+    {"type": "cancel", "id": "r1"}
+    {"type": "ping"}
+服务端消息:
+    {"type": "ready", "max_inflight": 64}
+    {"type": "response", "id": "r1", "served_model": "...", "body": {...}}   非流式结果
+    {"type": "start", "id": "r1", "served_model": "..."}                    流式开始
+    {"type": "chunk", "id": "r1", "data": {...}}                            流式数据块(上游SSE事件)
+    {"type": "done", "id": "r1"}                                            流式结束
+    {"type": "error", "id": "r1", "error": {"message": "...", "type": "http_error", "code": 429}}
+    {"type": "cancelled", "id": "r1"}
+    {"type": "pong"}
+"""
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from loguru import logger
+from pydantic import ValidationError
+
+from ..config import WebSocketConfig, config
+from ..models import ChatCompletionRequest
+from .. import deadline
+from .fallback import served_model
+from .llm_service import LLMService
+from .session_service import SessionService
+
+
+class MultiplexConnection:
+    """单个WebSocket连接上的多路请求调度"""
+
+    def __init__(self, websocket: WebSocket, api_key: str, settings: WebSocketConfig):
+        self.websocket = websocket
+        self.api_key = api_key
+        self.settings = settings
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=max(1, settings.send_queue_size))
+        self.stats = {"requests": 0, "cancelled": 0, "rejected": 0}
+
+    @staticmethod
+    async def authenticate(websocket: WebSocket, settings: WebSocketConfig) -> Optional[str]:
+        """认证连接：优先使用Authorization头，否则等待首条auth消息；失败时关闭连接并返回None"""
+        api_key = ""
+        authorization = websocket.headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            api_key = authorization[7:].strip()
+        else:
+            try:
+                message = json.loads(await asyncio.wait_for(websocket.receive_text(), settings.auth_timeout))
+                if isinstance(message, dict) and message.get("type") == "auth":
+                    api_key = str(message.get("api_key") or "")
+            except WebSocketDisconnect:
+                # 客户端在认证前断开，连接已关闭，无需再回复
+                return None
+            except asyncio.TimeoutError:
+                pass
+            except (ValueError, KeyError):
+                # 非JSON或二进制消息
+                pass
+
+        if not config.is_valid_api_key(api_key):
+            await websocket.send_text(json.dumps(_error(None, 401, "无效的API密钥"), ensure_ascii=False))
+            await websocket.close(code=1008)
+            return None
+        return api_key
+
+    async def serve(self):
+        """读取客户端消息并分发，连接断开时取消所有未完成的请求"""
+        writer = asyncio.create_task(self._write_loop())
+        await self._put({"type": "ready", "max_inflight": self.settings.max_inflight})
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                text = message.get("text")
+                if text is None:
+                    text = (message.get("bytes") or b"").decode("utf-8", "replace")
+                await self._dispatch(text)
+        finally:
+            tasks = list(self._tasks.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.cancel()
+            try:
+                await writer
+            except (asyncio.CancelledError, Exception):
+                pass
+            logger.info(f"WebSocket连接已关闭: 请求{self.stats['requests']}个, "
+                        f"取消{self.stats['cancelled']}个, 拒绝{self.stats['rejected']}个")
+
+    async def _dispatch(self, text: str):
+        """处理一条客户端消息"""
+        # UTF-8下字节数不少于字符数、不超过字符数的4倍，只在无法直接判断时才编码计算
+        max_bytes = self.settings.max_message_bytes
+        if len(text) > max_bytes or (len(text) * 4 > max_bytes and len(text.encode("utf-8")) > max_bytes):
+            await self._put(_error(None, 413, f"消息超过大小上限: {max_bytes}字节"))
+            return
+        try:
+            message = json.loads(text)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            await self._put(_error(None, 400, "消息必须是JSON对象"))
+            return
+
+        kind = message.get("type")
+        request_id = message.get("id")
+        if kind == "ping":
+            await self._put({"type": "pong"})
+            return
+        if kind == "cancel":
+            # 已结束的请求忽略取消；未结束的请求只会收到cancelled这一条结束消息
+            task = self._tasks.pop(request_id, None) if isinstance(request_id, str) else None
+            if task is not None and not task.done():
+                task.cancel()
+                self.stats["cancelled"] += 1
+                await self._put({"type": "cancelled", "id": request_id})
+            return
+        if kind != "request":
+            await self._put(_error(request_id, 400, f"不支持的消息类型: {kind}"))
+            return
+
+        if not isinstance(request_id, str) or not request_id:
+            await self._put(_error(None, 400, "请求缺少id"))
+            return
+        if request_id in self._tasks:
+            await self._put(_error(request_id, 409, f"请求id正在处理中: {request_id}"))
+            return
+        if len(self._tasks) >= self.settings.max_inflight:
+            self.stats["rejected"] += 1
+            await self._put(_error(request_id, 429, f"并发请求数超过上限: {self.settings.max_inflight}"))
+            return
+        try:
+            request = ChatCompletionRequest.model_validate(message.get("body"))
+            timeout = _timeout(message.get("timeout"))
+        except ValidationError as e:
+            await self._put(_error(request_id, 422, f"请求参数错误: {e}"))
+            return
+        except HTTPException as e:
+            await self._put(_error(request_id, e.status_code, e.detail))
+            return
+
+        self.stats["requests"] += 1
+        self._tasks[request_id] = asyncio.create_task(self._run(request_id, request, timeout))
+
+    async def _run(self, request_id: str, request: ChatCompletionRequest, timeout: Optional[float]):
+        """执行一个请求，结果和错误都以消息形式返回给客户端"""
+        token = deadline.set_deadline(timeout)
+        try:
+            if request.stream:
+                await self._stream(request_id, request)
+            else:
+                if request.session_id:
+                    response = await SessionService.chat_completion(request, self.api_key)
+                else:
+                    response = await LLMService.chat_completion(request)
+                await self._put({
+                    "type": "response", "id": request_id, "served_model": served_model.get(), "body": response
+                })
+        except HTTPException as e:
+            await self._put(_error(request_id, e.status_code, e.detail))
+        except Exception as e:
+            logger.error(f"WebSocket请求失败: id={request_id}, model={request.model}, {e}")
+            await self._put(_error(request_id, 500, f"模型调用失败: {str(e)}"))
+        finally:
+            deadline.reset_deadline(token)
+            if self._tasks.get(request_id) is asyncio.current_task():
+                self._tasks.pop(request_id)
+
+    async def _stream(self, request_id: str, request: ChatCompletionRequest):
+        """流式请求：上游SSE事件逐个转发为chunk消息"""
+        if request.session_id:
+            stream = await SessionService.chat_completion_stream(request, self.api_key)
+        else:
+            stream = await LLMService.chat_completion_stream(request)
+
+        encoded_id = json.dumps(request_id, ensure_ascii=False)
+        reader = _SSEReader()
+        failed = False
+        try:
+            await self._put({"type": "start", "id": request_id, "served_model": served_model.get()})
+            async for chunk in stream:
+                for data in reader.feed(chunk):
+                    if data == "[DONE]":
+                        continue
+                    try:
+                        event = json.loads(data)
+                    except ValueError:
+                        continue
+                    if isinstance(event, dict) and "error" in event:
+                        failed = True
+                        await self._put({"type": "error", "id": request_id, "error": event["error"]})
+                        continue
+                    # 事件原样拼接进消息，避免重复序列化
+                    await self._put_text(f'{{"type": "chunk", "id": {encoded_id}, "data": {data}}}')
+        finally:
+            # 取消(例如start消息仍在等待队列空位)或出错时显式关闭：
+            # 释放上游响应、副本占用和会话锁，迭代尚未开始时同样有效
+            await stream.aclose()
+        if not failed:
+            await self._put({"type": "done", "id": request_id})
+
+    async def _put(self, message: Dict[str, Any]):
+        await self._put_text(json.dumps(message, ensure_ascii=False))
+
+    async def _put_text(self, text: str):
+        # 队列满时在此等待，调用方随之停止读取上游
+        await self._outbox.put(text)
+
+    async def _write_loop(self):
+        """唯一的写协程，保证同一连接上的消息按序发送"""
+        while True:
+            text = await self._outbox.get()
+            await self.websocket.send_text(text)
+
+
+class _SSEReader:
+    """将SSE字节流切分为data字段"""
+
+    def __init__(self):
+        self._buffer = b""
+
+    def feed(self, chunk: bytes) -> List[str]:
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b"\n")
+        events = []
+        for line in lines:
+            line = line.strip()
+            if line.startswith(b"data:"):
+                events.append(line[5:].strip().decode("utf-8"))
+        return events
+
+
+def _error(request_id: Optional[str], status_code: int, message: Any) -> Dict[str, Any]:
+    """错误消息，格式与HTTP接口的错误响应一致"""
+    return {"type": "error", "id": request_id, "error": {"message": message, "type": "http_error", "code": status_code}}
+
+
+def _timeout(value: Any) -> Optional[float]:
+    """单个请求的超时：客户端指定值与服务端默认值取较小者"""
+    default = config.server.default_request_timeout or None
+    if value is None:
+        return default
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="timeout必须是数字")
+    if timeout <= 0:
+        raise HTTPException(status_code=504, detail="请求到达时已超过截止时间")
+    return min(timeout, default) if default else timeout
@@ -0,0 +1,305 @@
+"""
+会话服务模块
+客户端只发送会话ID和新消息，网关在服务端保存历史并拼接完整上下文转发上游，
+助手回复自动追加到历史。历史按LRU/TTL淘汰，可选溢出到磁盘。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from loguru import logger
+
+from ..config import SessionConfig, config
+from ..models import ChatCompletionRequest
+from .. import deadline
+from .llm_service import ClosingStream, LLMService
+
+# 每条消息在内存中的额外开销估算(元组+引用)
+_MESSAGE_OVERHEAD = 72
+
+
+class Session:
+    """单个会话，消息以(role, content)元组紧凑存储"""
+
+    __slots__ = ("messages", "size", "updated", "lock")
+
+    def __init__(self, messages: Optional[List[Tuple[str, str]]] = None):
+        self.messages: List[Tuple[str, str]] = messages or []
+        self.size = sum(_message_size(m) for m in self.messages)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def payload(self, new_messages: List[Tuple[str, str]]) -> List[Dict[str, str]]:
+        """拼接历史和新消息，生成上游请求的messages"""
+        return [{"role": role, "content": content} for role, content in self.messages + new_messages]
+
+
+def _message_size(message: Tuple[str, str]) -> int:
+    return sys.getsizeof(message[1]) + _MESSAGE_OVERHEAD
+
+
+class SessionStore:
+    """内存有界的会话存储(LRU + TTL + 可选磁盘溢出)"""
+
+    def __init__(self, settings: SessionConfig):
+        self.settings = settings
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.bytes = 0
+        self.stats = {"created": 0, "evicted": 0, "expired": 0, "spilled": 0, "restored": 0}
+
+    def get(self, key: str, create: bool = True) -> Optional[Session]:
+        """获取会话(刷新LRU顺序)，内存中不存在时尝试从磁盘恢复"""
+        session = self._sessions.get(key)
+        if session is not None and self._expired(session):
+            self.delete(key)
+            self.stats["expired"] += 1
+            session = None
+        if session is None:
+            session = self._restore(key)
+            if session is None:
+                if not create:
+                    return None
+                session = Session()
+                self.stats["created"] += 1
+            self._sessions[key] = session
+            self.bytes += session.size
+            session.updated = time.monotonic()
+            self.evict(keep=key)
+        self._sessions.move_to_end(key)
+        session.updated = time.monotonic()
+        return session
+
+    def append(self, key: str, session: Session, messages: List[Tuple[str, str]]):
+        """追加消息并按需淘汰其他会话"""
+        if self._sessions.get(key) is not session:
+            # 等待锁期间会话可能已被淘汰，重新放回存储
+            self.delete(key)
+            self._sessions[key] = session
+            self.bytes += session.size
+        self._sessions.move_to_end(key)
+
+        for role, content in messages:
+            message = (sys.intern(role), content)
+            session.messages.append(message)
+            size = _message_size(message)
+            session.size += size
+            self.bytes += size
+        # 单会话消息数上限，超出时丢弃最早的非系统消息
+        while len(session.messages) > self.settings.max_messages:
+            index = next((i for i, (role, _) in enumerate(session.messages) if role != "system"), 0)
+            size = _message_size(session.messages.pop(index))
+            session.size -= size
+            self.bytes -= size
+        session.updated = time.monotonic()
+        self.evict(keep=key)
+
+    def delete(self, key: str) -> bool:
+        """删除会话(包括磁盘上的溢出文件)"""
+        session = self._sessions.pop(key, None)
+        if session is not None:
+            self.bytes -= session.size
+        path = self._spill_path(key)
+        if path and os.path.exists(path):
+            os.remove(path)
+            return True
+        return session is not None
+
+    def evict(self, keep: str = ""):
+        """淘汰过期会话，并在超出数量/内存上限时淘汰最久未使用的会话"""
+        # 字典按最近使用排序，从头部开始检查即可
+        skipped = 0
+        while len(self._sessions) > skipped:
+            key, session = next(iter(self._sessions.items()))
+            expired = self._expired(session)
+            over_limit = self.bytes > self.settings.max_bytes or len(self._sessions) > self.settings.max_sessions
+            if not expired and not over_limit:
+                break
+            if key == keep or session.lock.locked():
+                # 正在使用的会话移到队尾，避免淘汰
+                self._sessions.move_to_end(key)
+                skipped += 1
+                continue
+            self._sessions.pop(key)
+            self.bytes -= session.size
+            if expired:
+                self.stats["expired"] += 1
+            elif self._spill(key, session):
+                self.stats["spilled"] += 1
+            else:
+                self.stats["evicted"] += 1
+
+    def _expired(self, session: Session) -> bool:
+        return time.monotonic() - session.updated > self.settings.ttl
+
+    def _spill_path(self, key: str) -> str:
+        if not self.settings.spill_dir:
+            return ""
+        return os.path.join(self.settings.spill_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".session")
+
+    def _spill(self, key: str, session: Session) -> bool:
+        """将会话压缩后写入磁盘"""
+        path = self._spill_path(key)
+        if not path:
+            return False
+        try:
+            os.makedirs(self.settings.spill_dir, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(zlib.compress(json.dumps(session.messages, ensure_ascii=False).encode("utf-8")))
+            return True
+        except OSError as e:
+            logger.error(f"会话溢出到磁盘失败: {e}")
+            return False
+
+    def _restore(self, key: str) -> Optional[Session]:
+        """从磁盘恢复会话(超过TTL的文件直接删除)"""
+        path = self._spill_path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            if time.time() - os.path.getmtime(path) > self.settings.ttl:
+                self.stats["expired"] += 1
+                return None
+            with open(path, "rb") as f:
+                messages = json.loads(zlib.decompress(f.read()))
+            self.stats["restored"] += 1
+            return Session([(sys.intern(role), content) for role, content in messages])
+        except (OSError, ValueError, zlib.error) as e:
+            logger.error(f"从磁盘恢复会话失败: {e}")
+            return None
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "sessions": len(self._sessions), "bytes": self.bytes}
+
+
+session_store = SessionStore(config.sessions)
+
+
+class SessionService:
+    """会话模式的聊天调用"""
+
+    @staticmethod
+    def _key(owner: str, session_id: str) -> str:
+        # 会话按API密钥隔离，不同调用方无法读取彼此的历史
+        owner_hash = hashlib.sha256(owner.encode("utf-8")).hexdigest()[:16]
+        return f"{owner_hash}:{session_id}"
+
+    @staticmethod
+    async def chat_completion(request: ChatCompletionRequest, owner: str) -> Dict[str, Any]:
+        """非流式会话调用：成功后把新消息和助手回复一起写入历史"""
+        key = SessionService._key(owner, request.session_id)
+        session = session_store.get(key)
+        new_messages = [(msg.role, msg.content) for msg in request.messages]
+
+        await SessionService._acquire(session)
+        try:
+            response = await LLMService.chat_completion(request, session.payload(new_messages))
+            reply = _extract_reply(response)
+            session_store.append(key, session, new_messages + ([("assistant", reply)] if reply is not None else []))
+        finally:
+            session.lock.release()
+        return response
+
+    @staticmethod
+    async def chat_completion_stream(request: ChatCompletionRequest, owner: str) -> ClosingStream:
+        """流式会话调用：透传SSE的同时累积助手回复，流结束后写入历史；流关闭时释放会话锁"""
+        key = SessionService._key(owner, request.session_id)
+        session = session_store.get(key)
+        new_messages = [(msg.role, msg.content) for msg in request.messages]
+
+        await SessionService._acquire(session)
+        try:
+            stream = await LLMService.chat_completion_stream(request, session.payload(new_messages))
+        except BaseException:
+            session.lock.release()
+            raise
+
+        async def iterate() -> AsyncIterator[bytes]:
+            parser = _DeltaCollector()
+            async for chunk in stream:
+                parser.feed(chunk)
+                yield chunk
+            if parser.completed and not parser.failed:
+                session_store.append(key, session, new_messages + [("assistant", parser.content)])
+
+        async def close():
+            # 迭代未开始就被关闭时也会执行，保证会话锁和上游连接被释放
+            try:
+                await stream.aclose()
+            finally:
+                session.lock.release()
+
+        return ClosingStream(iterate(), close)
+
+    @staticmethod
+    async def _acquire(session: Session):
+        """等待会话锁(同一会话的请求串行执行)，等待时间受请求截止时间约束"""
+        await deadline.run(session.lock.acquire(), None, "等待会话锁")
+
+    @staticmethod
+    def get_history(owner: str, session_id: str) -> List[Dict[str, str]]:
+        session = session_store.get(SessionService._key(owner, session_id), create=False)
+        if session is None:
+            raise HTTPException(status_code=404, detail=f"会话不存在: {session_id}")
+        return session.payload([])
+
+    @staticmethod
+    def delete(owner: str, session_id: str):
+        if not session_store.delete(SessionService._key(owner, session_id)):
+            raise HTTPException(status_code=404, detail=f"会话不存在: {session_id}")
+
+
+def _extract_reply(response: Dict[str, Any]) -> Optional[str]:
+    try:
+        return response["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+class _DeltaCollector:
+    """从SSE数据块中累积choices[0].delta.content"""
+
+    def __init__(self):
+        self._buffer = b""
+        self._parts: List[str] = []
+        self.completed = False
+        self.failed = False
+
+    @property
+    def content(self) -> str:
+        return "".join(self._parts)
+
+    def feed(self, chunk: bytes):
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            line = line.strip()
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                self.completed = True
+                continue
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            if "error" in event:
+                self.failed = True
+                continue
+            for choice in event.get("choices") or []:
+                if choice.get("index", 0) == 0:
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        self._parts.append(content)
+                    if choice.get("finish_reason"):
+                        self.completed = True
@@ -0,0 +1,111 @@
+"""
+上游超时模块
+按模型计算连接、首字节、分块间隔和总超时，可选根据观测到的延迟分位数自适应收紧
+流式调用的首字节和分块间隔超时
+"""
+import math
+from collections import deque
+from typing import Deque, Dict, NamedTuple, Optional, Sequence, Tuple
+
+from ..config import ModelConfig
+
+
+class UpstreamTimeouts(NamedTuple):
+    """一次上游调用各阶段的超时(秒)"""
+    connect: float
+    first_byte: float
+    idle: float
+    total: float
+
+
+class LatencyTracker:
+    """记录最近的首字节耗时和分块间隔，计算分位数"""
+
+    def __init__(self, window: int):
+        self.first_byte: Deque[float] = deque(maxlen=window)
+        self.idle: Deque[float] = deque(maxlen=window)
+        self.total: Deque[float] = deque(maxlen=window)
+
+    @staticmethod
+    def percentile(samples: Sequence[float], q: float) -> Optional[float]:
+        """计算分位数(最近邻法)，无样本时返回None"""
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[index]
+
+    def snapshot(self, q: float) -> Dict[str, Optional[float]]:
+        return {
+            "samples": len(self.total),
+            "first_byte": self.percentile(self.first_byte, q),
+            "idle": self.percentile(self.idle, q),
+            "total": self.percentile(self.total, q),
+        }
+
+
+# 按(模型名称, 是否流式)记录的延迟：流式调用的首字节是首个token的耗时，
+# 非流式调用的首字节要等完整生成，两者混在一起会让非流式的长生成被误判超时
+_trackers: Dict[Tuple[str, bool], LatencyTracker] = {}
+
+
+def get_tracker(model_config: ModelConfig, stream: bool) -> LatencyTracker:
+    key = (model_config.name, stream)
+    tracker = _trackers.get(key)
+    if tracker is None:
+        tracker = LatencyTracker(model_config.adaptive_window)
+        _trackers[key] = tracker
+    return tracker
+
+
+def record(model_config: ModelConfig, stream: bool, first_byte: float, total: float, max_idle: float = 0.0):
+    """记录一次成功调用的各阶段耗时"""
+    tracker = get_tracker(model_config, stream)
+    tracker.first_byte.append(first_byte)
+    tracker.total.append(total)
+    if max_idle > 0:
+        tracker.idle.append(max_idle)
+
+
+def _adapt(configured: float, observed: Optional[float], model_config: ModelConfig) -> float:
+    """自适应超时 = 分位数 × 倍数，限制在[最小值, 配置值]之间"""
+    if observed is None:
+        return configured
+    return min(configured, max(model_config.adaptive_min_timeout, observed * model_config.adaptive_multiplier))
+
+
+def resolve(model_config: ModelConfig, stream: bool) -> UpstreamTimeouts:
+    """计算模型当前使用的超时(只参考同一调用方式的观测延迟)"""
+    timeouts = UpstreamTimeouts(
+        connect=model_config.connect_timeout,
+        first_byte=model_config.first_byte_timeout,
+        idle=model_config.idle_timeout,
+        total=model_config.total_timeout,
+    )
+    if not model_config.adaptive_timeout:
+        return timeouts
+
+    tracker = _trackers.get((model_config.name, stream))
+    if tracker is None or len(tracker.total) < model_config.adaptive_min_samples:
+        return timeouts
+
+    # 只收紧与生成长度无关的阶段：分块间隔和流式调用的首字节(首个token)。
+    # 非流式调用的首字节和总耗时都要等完整生成，随max_tokens变化，总是保持配置值
+    q = model_config.adaptive_percentile
+    return UpstreamTimeouts(
+        connect=timeouts.connect,
+        first_byte=_adapt(timeouts.first_byte, tracker.percentile(tracker.first_byte, q), model_config)
+        if stream else timeouts.first_byte,
+        idle=_adapt(timeouts.idle, tracker.percentile(tracker.idle, q), model_config),
+        total=timeouts.total,
+    )
+
+
+def get_all_stats() -> Dict[str, Dict]:
+    """各模型观测延迟(p50/p99)，按流式/非流式分开"""
+    stats: Dict[str, Dict] = {}
+    for (name, stream), tracker in _trackers.items():
+        stats.setdefault(name, {})["stream" if stream else "non_stream"] = {
+            "p50": tracker.snapshot(0.5), "p99": tracker.snapshot(0.99)
+        }
+    return stats
@@ -0,0 +1,155 @@
+"""
+启动预热模块
+服务启动后并发预热所有启用的模型：预解析DNS、在共享连接池中预建连接、
+预取Request服务的token，并可选发送一次最小化探测请求。
+预热完成或超时前，就绪接口返回503，避免刚启动的实例承接流量时出现延迟尖刺。
+"""
+import asyncio
+import socket
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from fastapi import HTTPException
+from loguru import logger
+
+from ..config import ModelConfig, WarmupConfig, config
+from ..models import ChatCompletionRequest, ChatMessage
+from .http_client import get_client
+from .llm_service import LLMService
+
+
+class WarmupManager:
+    """预热任务管理与预热报告"""
+
+    def __init__(self, settings: WarmupConfig):
+        self.settings = settings
+        self.status = "pending" if settings.enabled else "disabled"
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.models: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status in ("completed", "timeout", "disabled")
+
+    def start(self):
+        """在后台启动预热(需在事件循环中调用)，不阻塞服务启动"""
+        if not self.settings.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """取消尚未完成的预热"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run(self):
+        """并发预热所有启用的模型，整体受timeout约束"""
+        self.status = "running"
+        self.started = time.time()
+        targets = config.get_all_models()
+        self.models = {model.name: {"status": "running", "steps": {}} for model in targets}
+        logger.info(f"开始预热模型: {len(targets)}个, 超时: {self.settings.timeout}s")
+
+        tasks = [asyncio.create_task(self._warm_model(model)) for model in targets]
+        try:
+            if tasks:
+                await asyncio.wait_for(asyncio.gather(*tasks), self.settings.timeout)
+            self.status = "completed"
+        except asyncio.TimeoutError:
+            self.status = "timeout"
+            for report in self.models.values():
+                if report["status"] == "running":
+                    report["status"] = "timeout"
+            logger.warning(f"模型预热超时({self.settings.timeout}s)，未完成的模型将在首次请求时建立连接")
+        finally:
+            self.finished = time.time()
+            for task in tasks:
+                task.cancel()
+
+        warmed = sum(1 for report in self.models.values() if report["status"] == "ok")
+        logger.info(f"模型预热结束: {warmed}/{len(targets)}个成功, 耗时: {self.finished - self.started:.2f}s")
+
+    async def _warm_model(self, model_config: ModelConfig):
+        """按顺序执行单个模型的预热步骤，任一步骤失败不影响其他模型"""
+        report = self.models[model_config.name]
+        base_urls = list(dict.fromkeys([model_config.base_url] + list(model_config.replicas)))
+        try:
+            await self._step(report, "dns", self._resolve(base_urls))
+            authorization = await self._step(report, "auth", LLMService._authorization(model_config))
+            await self._step(report, "connect", self._connect(model_config, base_urls, authorization))
+            if self.settings.probe:
+                await self._step(report, "probe", self._probe(model_config))
+            report["status"] = "ok"
+        except Exception as e:
+            report["status"] = "failed"
+            report["error"] = e.detail if isinstance(e, HTTPException) else f"{type(e).__name__}: {e}"
+            logger.warning(f"模型预热失败: {model_config.name}, {report['error']}")
+
+    @staticmethod
+    async def _step(report: Dict[str, Any], name: str, awaitable):
+        """执行一个预热步骤并记录耗时"""
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            report["steps"][name] = round((time.perf_counter() - started) * 1000, 3)
+
+    @staticmethod
+    async def _resolve(base_urls: List[str]):
+        """预解析上游主机名，提前暴露DNS错误并预热系统解析缓存"""
+        loop = asyncio.get_running_loop()
+        hosts = {(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+                 for parts in map(urlsplit, base_urls) if parts.hostname}
+        await asyncio.gather(*(
+            loop.getaddrinfo(host, port, type=socket.SOCK_STREAM) for host, port in hosts
+        ))
+
+    async def _connect(self, model_config: ModelConfig, base_urls: List[str], authorization: str):
+        """
+        通过共享连接池并发请求各上游地址的/models，完成TCP/TLS握手后连接保留在池中。
+        只要收到HTTP响应(即使不是200)即视为连接成功。
+        """
+        client = get_client()
+        headers = {"Authorization": authorization}
+        timeout = httpx.Timeout(model_config.connect_timeout)
+        await asyncio.gather(*(
+            client.get(f"{base_url}/models", headers=headers, timeout=timeout)
+            for base_url in base_urls
+            for _ in range(max(1, self.settings.connections))
+        ))
+
+    async def _probe(self, model_config: ModelConfig):
+        """发送一次最小化的探测请求，确认模型端到端可用(按模型的task选择嵌入或聊天接口)"""
+        if model_config.task == "embedding":
+            await LLMService.embeddings(model_config, [self.settings.probe_message])
+            return
+        # 直接调用该模型，不经过同名虚拟模型的回退链
+        request = ChatCompletionRequest(
+            model=model_config.name,
+            messages=[ChatMessage(role="user", content=self.settings.probe_message)],
+            max_tokens=1,
+        )
+        await LLMService._chat_completion(model_config, request, LLMService._messages(request))
+
+    def get_report(self) -> Dict[str, Any]:
+        return {
+            "status": self.status,
+            "ready": self.ready,
+            "started": self.started,
+            "duration_ms": round(((self.finished or time.time()) - self.started) * 1000, 3) if self.started else None,
+            "models": self.models,
+        }
+
+
+# 全局实例
+warmup_manager = WarmupManager(config.warmup)
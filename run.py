@@ -5,10 +5,19 @@ LLM网关运行脚本
 """
 import argparse
 import asyncio
+import json
+import multiprocessing
+import socket
+import sys
+import time
+import httpx
+import uvicorn
 from app.main import start_server
 from app.config import config
 from app.services.llm_service import LLMService
 from app.models import ChatCompletionRequest, ChatMessage
+from app.compression import available_encodings, compress_body
+from app.replay import run_replay, compare, create_mock_upstream
 from loguru import logger
 
 
@@ -71,16 +80,235 @@ def list_models():
         print("-" * 50)
 
 
+def bench_compression(rounds: int = 20):
+    """压缩基准测试：对比各算法/级别的压缩率与CPU耗时"""
+    content = "这是一段用于压缩基准测试的模型回复内容。The quick brown fox jumps over the lazy dog. " * 400
+    payloads = {
+        "models列表(~3KB)": json.dumps({
+            "object": "list",
+            "data": [{"id": f"model-{i}", "object": "model", "created": 1700000000,
+                      "owned_by": "llm-gateway", "type": "openai", "max_tokens": 8192,
+                      "enabled": True} for i in range(20)]
+        }).encode("utf-8"),
+        "非流式回复(~40KB)": json.dumps({
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": 1700000000,
+            "model": "bench", "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                           "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 8000, "total_tokens": 8010}
+        }, ensure_ascii=False).encode("utf-8"),
+    }
+    levels = {"gzip": [1, 6, 9], "br": [1, 4, 11], "zstd": [1, 3, 19]}
+    
+    print("\n压缩基准测试 (CPU耗时 vs 带宽节省)")
+    print("-" * 78)
+    print(f"{'负载':<16}{'算法':<8}{'级别':>6}{'原始字节':>12}{'压缩后':>10}{'压缩率':>8}{'耗时ms':>10}{'MB/s':>8}")
+    for name, data in payloads.items():
+        for encoding in available_encodings():
+            for level in levels[encoding]:
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    compressed = compress_body(data, encoding, level)
+                elapsed = (time.perf_counter() - start) / rounds
+                ratio = len(compressed) / len(data)
+                throughput = len(data) / elapsed / 1024 / 1024
+                print(f"{name:<16}{encoding:<8}{level:>6}{len(data):>12}{len(compressed):>10}"
+                      f"{ratio:>8.2%}{elapsed * 1000:>10.3f}{throughput:>8.1f}")
+    print("-" * 78)
+
+
+def _serve_mock_upstream(conn, latency_ms: float):
+    """在子进程中运行模拟上游，使其内存不计入网关进程；绑定系统分配的端口并通过conn告知父进程"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    conn.send(sock.getsockname()[1])
+    conn.close()
+    server = uvicorn.Server(uvicorn.Config(create_mock_upstream(latency_ms), log_level="warning"))
+    server.run(sockets=[sock])
+
+
+def _wait_for_mock_upstream(mock: multiprocessing.Process, conn, timeout: float = 30.0) -> int:
+    """等待模拟上游开始监听，返回端口"""
+    deadline = time.monotonic() + timeout
+    if not conn.poll(timeout):
+        raise RuntimeError("模拟上游启动超时")
+    port = conn.recv()
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1.0):
+                return port
+        except OSError:
+            if not mock.is_alive():
+                raise RuntimeError("模拟上游启动失败")
+            if time.monotonic() > deadline:
+                raise RuntimeError("模拟上游启动超时")
+            time.sleep(0.05)
+
+
+def _rss_mb() -> float:
+    """进程峰值常驻内存(MB)，ru_maxrss在Linux下单位为KB，在macOS下为字节"""
+    if sys.platform.startswith("linux"):
+        # ru_maxrss会跨fork/exec继承父进程的峰值(例如运行过其他测试的pytest进程)，
+        # VmHWM属于当前进程的地址空间，exec后重新计算
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+    import resource  # Windows没有resource模块，只在内存基准测试中导入
+    
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return maxrss / (1024 * 1024)
+    return maxrss / 1024
+
+
+async def _memory_load(model: str, requests: int, concurrency: int, payload_mb: float):
+    """向进程内网关并发发送大请求，返回状态码统计"""
+    from app.main import app
+    
+    body = json.dumps({
+        "model": model,
+        "messages": [{"role": "user", "content": "x" * int(payload_mb * 1024 * 1024)}],
+    }).encode("utf-8")
+    headers = {"Authorization": f"Bearer {config.auth.api_keys[0]}", "Content-Type": "application/json"}
+    semaphore = asyncio.Semaphore(concurrency)
+    status: dict = {}
+    
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://gateway",
+                                 timeout=None) as client:
+        async def send():
+            async with semaphore:
+                response = await client.post("/v1/chat/completions", content=body, headers=headers)
+                status[response.status_code] = status.get(response.status_code, 0) + 1
+        
+        await asyncio.gather(*(send() for _ in range(requests)))
+    return status
+
+
+def memory_budget_mb(payload_mb: float, inflight: int) -> float:
+    """
+    默认的峰值RSS增长上限：固定开销 + 每个在途请求6倍请求体。
+    每个在途请求的读取缓冲、解析后的消息和上游请求体各占约一份请求体大小(实测约4~4.5倍)，
+    上限留出约1/3余量，请求体被额外缓冲多份的回归会超出上限
+    """
+    return 32 + 6 * payload_mb * inflight
+
+
+def bench_memory(args) -> int:
+    """内存基准测试：并发处理大请求时网关进程的峰值RSS增长"""
+    try:
+        import resource  # noqa: F401
+    except ImportError:
+        print("❌ 内存基准测试依赖resource模块，当前平台不支持")
+        return 1
+    
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    mock = multiprocessing.Process(target=_serve_mock_upstream, args=(child_conn, args.mock_latency), daemon=True)
+    mock.start()
+    try:
+        port = _wait_for_mock_upstream(mock, parent_conn)
+        for model in config.get_all_models():
+            model.base_url = f"http://127.0.0.1:{port}/v1"
+            model.replicas = []
+        
+        baseline = _rss_mb()
+        started = time.perf_counter()
+        status = asyncio.run(_memory_load(args.model, args.requests, args.concurrency, args.payload_mb))
+        elapsed = time.perf_counter() - started
+        growth = _rss_mb() - baseline
+    finally:
+        mock.terminate()
+    
+    print("\n内存基准测试 (峰值RSS)")
+    print("-" * 60)
+    print(f"请求数: {args.requests}, 并发: {args.concurrency}, 单个请求体: {args.payload_mb}MB")
+    print(f"状态码: {status}, 耗时: {elapsed:.2f}s")
+    print(f"基线RSS: {baseline:.1f}MB, 峰值增长: {growth:.1f}MB, "
+          f"每个在途请求: {growth / max(1, min(args.concurrency, args.requests)):.2f}MB")
+    print("-" * 60)
+    
+    if set(status) != {200}:
+        # 请求失败时没有走完整链路，内存数据没有意义
+        print(f"❌ 存在失败的请求: {status}")
+        return 1
+    
+    limit = args.max_rss_mb
+    if limit is None:
+        limit = memory_budget_mb(args.payload_mb, min(args.concurrency, args.requests))
+    if limit and growth > limit:
+        print(f"❌ 峰值RSS增长超过上限: {growth:.1f}MB > {limit:.1f}MB")
+        return 1
+    if limit:
+        print(f"✅ 峰值RSS增长在上限内: {growth:.1f}MB <= {limit:.1f}MB")
+    return 0
+
+
+def replay_capture(args) -> int:
+    """回放采集文件，输出延迟分布并与基线对比"""
+    summary = asyncio.run(run_replay(
+        args.capture,
+        speed=args.speed,
+        target=args.target,
+        api_key=args.api_key,
+        mock_upstream=args.mock_upstream,
+        mock_latency_ms=args.mock_latency,
+        concurrency=args.concurrency,
+    ))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        logger.info(f"回放结果已保存: {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(summary, baseline, args.regression_threshold)
+        print("\n与基线对比:")
+        print("-" * 60)
+        for row in rows:
+            flag = "  <- 回归" if row["regression"] else ""
+            print(f"{row['metric']:<16}{row['baseline']:>10.2f} -> {row['current']:>10.2f} ({row['change']:+.1%}){flag}")
+        print("-" * 60)
+        regressions = [row["metric"] for row in rows if row["regression"]]
+        if regressions:
+            print(f"❌ 延迟回归: {', '.join(regressions)}")
+            return 1
+        print("✅ 未发现延迟回归")
+    return 0
+
+
 def main():
     """主函数"""
     parser = argparse.ArgumentParser(description="LLM网关服务")
-    parser.add_argument("--mode", choices=["server", "local", "test", "list"], default="server",
-                       help="运行模式: server(网络服务), local(本地调用), test(测试模型), list(列出模型)")
+    parser.add_argument("--mode", choices=["server", "local", "test", "list", "bench", "replay", "memory"],
+                       default="server",
+                       help="运行模式: server(网络服务), local(本地调用), test(测试模型), list(列出模型), "
+                            "bench(压缩基准测试), replay(回放采集流量), memory(大请求内存基准测试)")
     parser.add_argument("--host", default=None, help="服务器主机地址")
     parser.add_argument("--port", type=int, default=None, help="服务器端口")
     parser.add_argument("--reload", action="store_true", help="开发模式，自动重载")
     parser.add_argument("--model", default="gpt-3.5-turbo", help="本地模式使用的模型")
     parser.add_argument("--message", default="你好", help="本地模式的消息内容")
+    # 回放模式参数
+    parser.add_argument("--capture", nargs="+", default=["captures"], help="回放的采集文件或目录")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数，1为原始速度，0为最大速度")
+    parser.add_argument("--target", default=None, help="回放目标网关地址，默认在进程内启动网关")
+    parser.add_argument("--api-key", default=None, help="回放使用的API密钥，默认取配置中的第一个")
+    parser.add_argument("--mock-upstream", action="store_true", help="启动本地模拟上游并将所有模型指向它")
+    parser.add_argument("--mock-latency", type=float, default=50.0, help="模拟上游延迟(毫秒)")
+    parser.add_argument("--concurrency", type=int, default=100, help="回放最大并发数")
+    parser.add_argument("--output", default=None, help="保存回放结果的JSON文件")
+    parser.add_argument("--baseline", default=None, help="对比的基线结果JSON文件")
+    parser.add_argument("--regression-threshold", type=float, default=0.1, help="判定延迟回归的相对阈值")
+    # 内存基准测试参数(同时使用--model、--concurrency和--mock-latency)
+    parser.add_argument("--requests", type=int, default=500, help="内存基准测试的请求总数")
+    parser.add_argument("--payload-mb", type=float, default=1.0, help="内存基准测试的单个请求体大小(MB)")
+    parser.add_argument("--max-rss-mb", type=float, default=None,
+                        help="峰值RSS增长上限(MB)，超出时返回非零退出码；默认按请求体大小和并发数计算，0为不检查")
     
     args = parser.parse_args()
     
@@ -98,6 +326,17 @@ def main():
     
     elif args.mode == "list":
         list_models()
+    
+    elif args.mode == "bench":
+        bench_compression()
+    
+    elif args.mode == "replay":
+        logger.info("启动流量回放模式")
+        sys.exit(replay_capture(args))
+    
+    elif args.mode == "memory":
+        logger.info("启动内存基准测试模式")
+        sys.exit(bench_memory(args))
 
 
 if __name__ == "__main__":
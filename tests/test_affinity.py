@@ -0,0 +1,77 @@
+"""
+前缀亲和路由测试
+一致性哈希的前缀粘性，以及有界负载容量和溢出
+"""
+import math
+
+from app.config import ModelConfig
+from app.services.affinity import PrefixAffinityRouter, prefix_key
+
+REPLICAS = ["http://r1/v1", "http://r2/v1", "http://r3/v1"]
+
+
+def make_router(load_factor: float = 1.25) -> PrefixAffinityRouter:
+    return PrefixAffinityRouter(ModelConfig(
+        name="self-hosted", type="openai", base_url=REPLICAS[0],
+        replicas=REPLICAS, routing="prefix_affinity", affinity_load_factor=load_factor,
+    ))
+
+
+def conversation(system: str, *turns: str):
+    return [{"role": "system", "content": system}] + [{"role": "user", "content": turn} for turn in turns]
+
+
+def test_prefix_key_normalizes_whitespace_and_ignores_later_turns():
+    base = prefix_key(conversation("你是助手", "问题一", "问题二"), 2)
+    assert prefix_key(conversation(" 你是助手\n", "问题一", " 问题二 "), 2) == base
+    assert prefix_key(conversation("你是助手", "问题一", "问题二", "问题三"), 2) == base
+    assert prefix_key(conversation("另一个系统提示词", "问题一", "问题二"), 2) != base
+
+
+def test_same_prefix_routes_to_same_replica():
+    """无负载时相同前缀总是落在同一副本"""
+    router = make_router()
+    messages = conversation("系统提示词", "你好")
+    first = router.acquire(messages)
+    router.release(first)
+    for _ in range(10):
+        replica = router.acquire(messages)
+        router.release(replica)
+        assert replica == first
+    stats = router.get_stats()
+    assert stats["home_routed"] == 11
+    assert stats["spillovers"] == 0
+    assert stats["prefix_hits"] == 10
+    assert stats["new_prefixes"] == 1
+
+
+def test_bounded_load_spills_over():
+    """同一前缀持续涌入时，单副本在途请求数不超过有界负载容量，超出部分溢出到其他副本"""
+    router = make_router(load_factor=1.25)
+    messages = conversation("热点提示词", "你好")
+    home = None
+    for i in range(30):
+        capacity = math.ceil(1.25 * (i + 1) / len(REPLICAS))
+        replica = router.acquire(messages)
+        home = home or replica
+        assert max(router.inflight.values()) <= capacity
+
+    stats = router.get_stats()
+    assert stats["spillovers"] > 0
+    assert stats["home_routed"] + stats["spillovers"] == 30
+    assert router.inflight[home] == max(router.inflight.values())
+    assert all(count > 0 for count in router.inflight.values())
+    assert sum(router.inflight.values()) == 30
+
+
+def test_release_returns_capacity():
+    router = make_router()
+    messages = conversation("系统提示词", "你好")
+    replicas = [router.acquire(messages) for _ in range(6)]
+    for replica in replicas:
+        router.release(replica)
+    assert all(count == 0 for count in router.inflight.values())
+    # 多余的release不会让计数变为负数
+    router.release(replicas[0])
+    assert router.inflight[replicas[0]] == 0
+    assert router.acquire(messages) == replicas[0]
@@ -0,0 +1,77 @@
+"""
+压缩模块测试
+请求体流式解压的正确性与大小上限(压缩炸弹)，以及Accept-Encoding协商
+"""
+import os
+import tracemalloc
+
+import pytest
+
+from app.compression import Decompressor, available_encodings, compress_body, negotiate_encoding
+
+ENCODINGS = available_encodings()
+
+
+def decompress_chunks(decompressor: Decompressor, data: bytes, chunk_size: int) -> bytes:
+    return b"".join(decompressor.decompress(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size))
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+@pytest.mark.parametrize("chunk_size", [7, 1000, 1 << 20])
+def test_decompress_round_trip(encoding, chunk_size):
+    """任意切块方式下都能完整还原请求体"""
+    data = os.urandom(100_000) + b"x" * 400_000
+    compressed = compress_body(data, encoding)
+    assert decompress_chunks(Decompressor(encoding, 1 << 20), compressed, chunk_size) == data
+
+
+def test_decompress_deflate_round_trip():
+    import zlib
+
+    data = b"hello " * 10_000
+    assert decompress_chunks(Decompressor("deflate", 1 << 20), zlib.compress(data), 1000) == data
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_decompress_over_limit(encoding):
+    """解压后超过上限时抛出OverflowError"""
+    compressed = compress_body(b"x" * 200_000, encoding)
+    with pytest.raises(OverflowError):
+        decompress_chunks(Decompressor(encoding, 100_000), compressed, 1000)
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_decompression_bomb_memory_bounded(encoding):
+    """压缩炸弹：单个小数据块解压出的内容不会在检查上限前整体展开"""
+    bomb = compress_body(b"\0" * (64 << 20), encoding, 19 if encoding == "zstd" else None)
+    limit = 1 << 20
+
+    tracemalloc.start()
+    try:
+        with pytest.raises(OverflowError):
+            decompress_chunks(Decompressor(encoding, limit), bomb, 32 * 1024)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 8 * limit
+
+
+def test_unsupported_encoding():
+    with pytest.raises(ValueError):
+        Decompressor("compress", 1024)
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, br, zstd", "zstd"),  # q值相同时按服务端优先级
+    ("br;q=0.5, gzip;q=0.8", "gzip"),  # q值优先
+    ("zstd;q=0, gzip", "gzip"),  # q=0表示不接受
+    ("*", "zstd"),
+    ("*;q=0.1, gzip;q=0.5", "gzip"),
+    ("GZIP", "gzip"),
+    ("gzip;q=abc, br", "br"),  # 非法q值视为0
+])
+def test_negotiate_encoding(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding, ["zstd", "br", "gzip"]) == expected
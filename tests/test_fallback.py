@@ -0,0 +1,115 @@
+"""
+虚拟模型回退测试
+可重试状态码触发回退、截止时间到达后停止回退、served_model记录实际提供服务的模型
+"""
+import asyncio
+from typing import List
+
+import pytest
+from fastapi import HTTPException
+
+from app import deadline
+from app.config import AliasConfig, ModelConfig, config
+from app.services import fallback
+
+
+@pytest.fixture(autouse=True)
+def models(monkeypatch):
+    monkeypatch.setattr(config, "models", {"test": [
+        ModelConfig(name="primary", type="openai", base_url="http://primary/v1"),
+        ModelConfig(name="secondary", type="openai", base_url="http://secondary/v1"),
+        ModelConfig(name="tertiary", type="openai", base_url="http://tertiary/v1"),
+        ModelConfig(name="disabled", type="openai", base_url="http://disabled/v1", enabled=False),
+    ]})
+    monkeypatch.setattr(config, "aliases", {
+        "chain": AliasConfig(name="chain", models=["primary", "disabled", "secondary", "tertiary"]),
+        "capped": AliasConfig(name="capped", models=["primary", "secondary", "tertiary"], max_attempts=2),
+    })
+    monkeypatch.setattr(fallback, "_stats", {})
+
+
+def failing(statuses: dict, calls: List[str], delay: float = 0.0):
+    """按模型名返回指定状态码的错误，未指定的模型调用成功"""
+    async def attempt(model_config: ModelConfig):
+        calls.append(model_config.name)
+        if delay:
+            await asyncio.sleep(delay)
+        status_code = statuses.get(model_config.name)
+        if status_code:
+            raise HTTPException(status_code=status_code, detail=f"{model_config.name}失败")
+        return model_config.name
+    return attempt
+
+
+def call(name: str, attempt, timeout=None):
+    """在新的上下文中调用，返回(结果或异常, served_model)"""
+    async def run():
+        token = deadline.set_deadline(timeout)
+        try:
+            result = await fallback.call(name, attempt)
+        except HTTPException as e:
+            result = e
+        finally:
+            deadline.reset_deadline(token)
+        return result, fallback.served_model.get()
+    return asyncio.run(run())
+
+
+def test_fails_over_on_retryable_status_and_skips_disabled():
+    calls = []
+    result, served = call("chain", failing({"primary": 503}, calls))
+    assert result == "secondary"
+    assert served == "secondary"
+    assert calls == ["primary", "secondary"]
+    stats = fallback.get_all_stats()["chain"]
+    assert stats["failovers"] == 1
+    assert stats["served"] == {"secondary": 1}
+
+
+def test_non_retryable_status_is_raised_immediately():
+    calls = []
+    result, served = call("chain", failing({"primary": 400}, calls))
+    assert isinstance(result, HTTPException) and result.status_code == 400
+    assert served is None
+    assert calls == ["primary"]
+
+
+def test_last_error_raised_when_all_targets_fail():
+    calls = []
+    result, _ = call("chain", failing({"primary": 429, "secondary": 502, "tertiary": 504}, calls))
+    assert isinstance(result, HTTPException) and result.status_code == 504
+    assert calls == ["primary", "secondary", "tertiary"]
+    assert fallback.get_all_stats()["chain"]["exhausted"] == 1
+
+
+def test_max_attempts_limits_targets():
+    calls = []
+    result, _ = call("capped", failing({"primary": 503, "secondary": 503}, calls))
+    assert isinstance(result, HTTPException) and result.status_code == 503
+    assert calls == ["primary", "secondary"]
+
+
+def test_stops_failing_over_once_deadline_passed():
+    """截止时间已过时不再尝试下一个模型"""
+    calls = []
+    result, served = call("chain", failing({"primary": 503}, calls, delay=0.05), timeout=0.02)
+    assert isinstance(result, HTTPException) and result.status_code == 503
+    assert served is None
+    assert calls == ["primary"]
+    assert fallback.get_all_stats()["chain"]["exhausted"] == 1
+
+
+def test_concrete_model_does_not_fail_over():
+    calls = []
+    result, served = call("primary", failing({"primary": 429}, calls))
+    assert isinstance(result, HTTPException) and result.status_code == 429
+    assert calls == ["primary"]
+
+    result, served = call("secondary", failing({}, []))
+    assert result == "secondary" and served == "secondary"
+    assert fallback.get_all_stats() == {}
+
+
+def test_unknown_model_returns_404():
+    result, _ = call("missing", failing({}, []))
+    assert isinstance(result, HTTPException) and result.status_code == 404
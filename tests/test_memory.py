@@ -0,0 +1,35 @@
+"""
+内存上限测试
+在独立进程中运行 run.py --mode memory，断言并发处理大请求时峰值RSS增长不超过按请求体大小和并发数计算的上限
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="峰值RSS依赖resource模块")
+
+
+def run_memory_bench(*args: str) -> subprocess.CompletedProcess:
+    # 峰值RSS是进程级的，必须在新进程中测量，避免其他测试的内存占用计入
+    return subprocess.run(
+        [sys.executable, "run.py", "--mode", "memory", "--mock-latency", "5", *args],
+        cwd=ROOT, capture_output=True, text=True, timeout=300,
+    )
+
+
+def test_peak_rss_bounded_for_concurrent_large_requests():
+    """20个并发的1MB请求，峰值RSS增长在默认上限内"""
+    result = run_memory_bench("--requests", "100", "--concurrency", "20", "--payload-mb", "1")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "峰值RSS增长在上限内" in result.stdout
+
+
+def test_peak_rss_bound_is_enforced():
+    """上限设置过低时基准测试返回非零退出码"""
+    result = run_memory_bench("--requests", "20", "--concurrency", "10", "--max-rss-mb", "1")
+    assert result.returncode == 1, result.stdout + result.stderr
+    assert "峰值RSS增长超过上限" in result.stdout